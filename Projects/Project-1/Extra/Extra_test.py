@@ -1,7 +1,13 @@
 from Extra_server import ExtraServer
 from Extra_client import ExtraClient
+from async_dispatcher import AsyncDispatcher
+from protocol import iter_reply, COMPRESSED
+from query_cache import QueryCache
+from suffix_array import SuffixArrayIndex
 from socket import socket, AF_INET, SOCK_STREAM
 import pytest
+import asyncio
+import threading
 alphabet = "'()-./abcdefghijklmnopqrstuvwxyz"
     
 def test_2():
@@ -35,3 +41,105 @@ def test_1():
     test1 = '??????????'
     _, matches = findQuery(test1)
     assert matches == 24071
+
+@pytest.mark.parametrize('engine', ['regex', 'ngram', 'suffix', 'numpy'])
+def test_engine_matches_loop(engine):
+    '''every engine must return exactly what the sliding-window loop returns, in the same order'''
+    if engine == 'numpy':
+        pytest.importorskip('numpy')
+    loopServer = ExtraServer(engine='loop')
+    engineServer = ExtraServer(engine=engine)
+    
+    for pattern in ['?', '?(a)', '-?-', '??????????', 'c?t', 'a.b', 'a', '', 'zzzz', 'ing?', 'quick', '?ing?', 'e?e?e', 'a??n', 'a\x07o']:   # control characters sort below the newline
+        words, matches = loopServer.findQuery(pattern)
+        assert engineServer.findQuery(pattern) == (words, matches)
+        assert engineServer.countQuery(pattern) == matches
+    for server in (loopServer, engineServer):   # about 70,000 words each, a batch reply too large to build
+        assert server.getReply('BATCH ? ?').startswith(b'400 ')
+
+def test_suffix_array_rebuilt_when_truncated(tmp_path):
+    path = str(tmp_path / 'words.sa')
+    words = ['cat', 'scatter', 'dog']
+    saved = SuffixArrayIndex.load(words, path)
+    assert SuffixArrayIndex.load(words, path).suffixes == saved.suffixes   # loaded, not sorted again
+    
+    with open(path, 'r+b') as f:    # a copy cut short, with an intact header
+        f.truncate(f.seek(0, 2) - 4)
+    index = SuffixArrayIndex.load(words, path)
+    assert index.suffixes == saved.suffixes
+    assert index.find('?at') == (['cat', 'scatter'], 2)
+    assert len(SuffixArrayIndex.load(words, path).suffixes) == 13   # saved again in full, one suffix per letter
+
+def test_async_dispatcher_serves_concurrent_clients():
+    testServer = ExtraServer(host='localhost', port=0)     # any free port
+    
+    async def client(port: int, query: str) -> bytes:
+        reader, writer = await asyncio.open_connection('localhost', port)
+        assert await reader.readexactly(6) == b'200 OK'
+        writer.write(query.encode())
+        reply = await reader.readline() + await reader.readline()
+        writer.close()
+        return reply
+    
+    async def scenario():
+        listener = await AsyncDispatcher(testServer).start()
+        port = listener.sockets[0].getsockname()[1]
+        replies = await asyncio.gather(*(client(port, '-?-') for _ in range(50)))
+        listener.close()
+        return replies
+    
+    replies = asyncio.run(scenario())
+    assert len(replies) == 50
+    assert all(reply.startswith(b' (Total matches: 13)\n') for reply in replies)
+
+def test_streamed_reply_matches_built_reply():
+    testServer = ExtraServer(cache=None)
+    
+    chunks = list(iter_reply(testServer, '?', chunk_size=4096))
+    assert len(chunks) > 100    # streamed in bounded chunks, not built in one piece
+    assert max(len(chunk) for chunk in chunks) < 4096 + 64
+    assert b''.join(chunks) == testServer.getReply('?')
+    assert list(iter_reply(testServer, '-?-')) == [testServer.getReply('-?-')]   # few matches, one piece
+    
+    testServer.countQuery = None    # few matches are built from the same pass that found them, never counted first
+    assert list(iter_reply(testServer, 'ing?')) == [testServer.getReply('ing?')]
+
+def test_streamed_reply_is_cached():
+    cache = QueryCache()
+    testServer = ExtraServer(cache=cache)
+    
+    streamed = b''.join(iter_reply(testServer, '?'))
+    assert cache.contains(testServer.view.cache_mode, '?')
+    assert list(iter_reply(testServer, '?')) == [streamed]  # served in one piece from the cache
+    
+    small = QueryCache(max_bytes=64 * 1024)
+    smallServer = ExtraServer(cache=small)
+    assert b''.join(iter_reply(smallServer, '?')) == streamed
+    assert not small.contains(smallServer.view.cache_mode, '?')  # over the budget, not kept while it was sent
+
+def test_compressed_replies_negotiated_by_client():
+    cache = QueryCache()
+    testServer = ExtraServer(cache=cache)
+    listener = socket(AF_INET, SOCK_STREAM)
+    listener.bind(('localhost', 0))
+    listener.listen(1)
+    
+    def accept():
+        connection, _ = listener.accept()
+        listener.close()
+        testServer.handleClient(connection)
+    
+    threading.Thread(target=accept, daemon=True).start()
+    client = ExtraClient(port=listener.getsockname()[1])
+    sock = client.connectToServer()
+    try:
+        for query in ['?', '?', 'ing?', '-?-']:     # streamed, then a cache hit, then built, then below the threshold
+            sock.send(query.encode())
+            assert client.receiveReply(sock).encode() == testServer.getReply(query)
+    finally:
+        client.closeConnection()
+    
+    stored = cache.get(testServer.view.cache_mode, '?')
+    assert stored.startswith(COMPRESSED)    # cached compressed, hits are sent without recompressing
+    assert len(stored) < len(testServer.getReply('?')) // 2
+    assert cache.get(testServer.view.cache_mode, '-?-') == testServer.getReply('-?-')
@@ -0,0 +1,75 @@
+'''Admission control for the thread pool dispatchers, shedding clients the pool can not take on'''
+import threading
+import time
+from concurrent.futures import Executor
+from socket import socket
+from protocol import encode_busy
+
+class AdmissionControl():
+    '''Bounds the connections waiting for a free dispatcher thread.
+
+    A connection is admitted while fewer than max_pending connections are waiting, otherwise it is
+    answered "503 BUSY" with a retry-after hint right away and closed, instead of waiting unseen
+    behind the pool. The counters and the time admitted connections waited are kept for stats.
+    '''
+    def __init__(self, max_pending: int=32, retry_after: float=1.0):
+        self.max_pending = max_pending
+        self.retry_after = retry_after  # seconds a shed client is told to wait before reconnecting
+        self.pending = 0        # admitted connections waiting for a thread
+        self.active = 0         # connections being served
+        self.admitted = 0
+        self.shed = 0
+        self.total_wait = 0.0   # seconds admitted connections spent waiting
+        self.max_wait = 0.0
+        self.lock = threading.Lock()
+
+    def submit(self, executor: Executor, handle, connection: socket) -> bool:
+        '''Queues handle(connection) on the executor, or sheds the connection when too many are waiting'''
+        with self.lock:
+            admitted = self.pending < self.max_pending
+            if admitted:
+                self.pending += 1
+                self.admitted += 1
+            else:
+                self.shed += 1
+
+        if not admitted:
+            try:
+                connection.sendall(encode_busy(self.retry_after))   # sent in place of the "200 OK" handshake
+            except OSError:
+                pass
+            connection.close()
+            return False
+
+        executor.submit(self.serve, handle, connection, time.perf_counter())
+        return True
+
+    def serve(self, handle, connection: socket, queued: float):
+        '''Runs on a pool thread, serving one admitted connection'''
+        waited = time.perf_counter() - queued
+        with self.lock:
+            self.pending -= 1
+            self.active += 1
+            self.total_wait += waited
+            self.max_wait = max(self.max_wait, waited)
+        try:
+            handle(connection)
+        finally:
+            with self.lock:
+                self.active -= 1
+
+    def stats(self) -> dict[str, int | float]:
+        '''Returns the queue depth, the shed count and how long admitted connections waited'''
+        with self.lock:
+            started = self.admitted - self.pending
+            arrivals = self.admitted + self.shed
+            return {
+                'pending': self.pending,
+                'active': self.active,
+                'max_pending': self.max_pending,
+                'admitted': self.admitted,
+                'shed': self.shed,
+                'shed_rate': self.shed / arrivals if arrivals else 0.0,
+                'mean_wait_ms': self.total_wait / started * 1000 if started else 0.0,
+                'max_wait_ms': self.max_wait * 1000,
+            }
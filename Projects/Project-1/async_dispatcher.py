@@ -0,0 +1,96 @@
+'''asyncio dispatcher serving a word server's queries to many clients from one event loop'''
+import asyncio
+import time
+from concurrent.futures import ThreadPoolExecutor
+from framing import PROTO_PREFIX, serve_framed_async
+from protocol import iter_reply, COMPRESS_PREFIX, negotiate_compression
+from serving import stream_threshold
+
+def now():
+    return time.ctime(time.time())
+
+class AsyncDispatcher():
+    '''Accepts clients with asyncio.start_server and speaks the same protocol as the threaded dispatchers.
+
+    Idle and waiting clients only cost a coroutine, so thousands of them can stay connected. The
+    CPU-heavy getReply calls of the server run in a thread pool so they never block the event loop.
+    '''
+    def __init__(self, server, workers: int=4, backlog: int=1024):
+        self.server = server        # any word server with host, port, getReply and metrics
+        self.workers = workers
+        self.backlog = backlog
+        self.executor: ThreadPoolExecutor | None = None
+
+    async def getReply(self, query: str) -> bytes:
+        '''Returns the server's reply to a query, computed in the thread pool'''
+        return await asyncio.get_running_loop().run_in_executor(self.executor, self.server.getReply, query)
+
+    async def handleClient(self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter):
+        '''Handles single client connection'''
+        address = writer.get_extra_info('peername')
+        print(f'Server connected with {address} at {now()}')
+        self.server.metrics.opened()
+        loop = asyncio.get_running_loop()
+        try:
+            writer.write('200 OK'.encode())     # initial handshake to inform client that server is ready
+            await writer.drain()
+            compress = False    # until the client negotiates compression
+
+            while True:
+                try:
+                    data = await reader.read(1024)  # receive data from client (their pattern query)
+                except ConnectionError as e:
+                    print('Error receiving data from client:', e)
+                    break
+                if not data: break
+
+                if data.startswith(PROTO_PREFIX):   # client upgrades the connection to the framed protocol
+                    await serve_framed_async(reader, writer, data, self.getReply)
+                    break
+
+                if data.startswith(COMPRESS_PREFIX):    # client asks for large replies to be compressed
+                    compress, answer = negotiate_compression(data)
+                    writer.write(answer)
+                    await writer.drain()
+                    continue
+
+                chunks = iter_reply(self.server, data.decode(), threshold=stream_threshold(self.server), compress=compress)   # large replies are streamed in bounded chunks
+                while (chunk := await loop.run_in_executor(self.executor, next, chunks, None)) is not None:
+                    writer.write(chunk)
+                    await writer.drain()    # wait while the client is slow to read, without blocking others
+
+            print('Client at', address, 'disconnected at', now())
+        except ConnectionError as e:
+            print('Error sending reply to client:', e)
+        finally:
+            print('Closing connection...')
+            writer.close()
+            self.server.metrics.closed()
+
+    async def start(self) -> asyncio.Server:
+        '''Starts listening and returns the asyncio server, clients are handled once the loop runs'''
+        if self.executor is None:
+            self.executor = ThreadPoolExecutor(max_workers=self.workers)
+        listener = await asyncio.start_server(self.handleClient, self.server.host, self.server.port, backlog=self.backlog)
+        print('Server started up on %s at %s' % (self.server.host, now()))
+        return listener
+
+    async def serve(self):
+        '''Starts the server and handles clients until cancelled'''
+        listener = await self.start()
+        async with listener:
+            await listener.serve_forever()
+
+    def dispatcher(self):
+        '''Starts the server, listen for incoming connections, handle clients concurrently on one event loop'''
+        print('Starting server on %s:%s' % (self.server.host, self.server.port))
+        try:
+            asyncio.run(self.serve())
+        except KeyboardInterrupt:
+            print('Server shutting down...')
+        except OSError as e:
+            print('Error starting server:', e)
+        finally:
+            if self.executor is not None:
+                self.executor.shutdown(wait=True)   # wait for any running queries to finish
+            print('Server socket closed.')
@@ -1,5 +1,16 @@
 import time, _thread as thread
 from socket import socket, AF_INET, SOCK_STREAM
+from collections.abc import Iterator
+import os, sys, tempfile
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))    # shared modules live in the project root
+from protocol import COMPRESS_PREFIX, negotiate_compression, iter_reply
+from query_cache import QueryCache, shared_cache
+from metrics import ServerMetrics
+from profiling import Profiler
+from framing import PROTO_PREFIX, serve_framed
+from wordstore import WordStore, get_store, reload_on_signal
+from serving import StoreView, cache_mode, get_reply, build_reply, batch_query, server_stats, use_store, reload_words
+from selector_dispatcher import SelectorDispatcher
 myHost = 'localhost'
 myPort = 50007
 
@@ -7,21 +18,27 @@ def now():
     return time.ctime(time.time())
 
 class BasicServer():
-    def __init__(self, host: str=myHost, port: int=myPort):
+    mode = 'word'  # matching semantics, part of the cache key, whole-word matches
+    unique = True  # matches the distinct words only, like a set
+
+    def __init__(self, host: str=myHost, port: int=myPort, engine: str='index', cache: QueryCache | None=shared_cache, slow_ms: float | None=None, profile_dir: str=tempfile.gettempdir()):
         self.host = host
         self.port = port
-        self.word_set = self.get_word_set()
-        
-    def get_word_set(self) -> set[str]:
-        '''Loads word list from file into a set'''
-        word_set = set()
+        self.cache = cache  # shared reply cache, None disables caching
+        self.engine_name = engine
+        self.cache_mode = cache_mode(self)   # servers matching another way never share cached replies
+        self.metrics = ServerMetrics(slow_ms)   # per-query counters and latencies, read with the STATS command, queries over slow_ms are logged
+        self.profiler = Profiler(profile_dir, type(self).__name__)   # PROFILE sessions write their files to profile_dir
+        self.useStore(get_store())  # dictionary shared by every server of the process
         
-        with open('../wordlist.txt', 'r') as f:
-            words = f.read().splitlines()   # Read lines without trailing newlines and store each line as an element in a list
-            for word in words:
-                word_set.add(word)  # add each word to the set
-        
-        return word_set
+    def useStore(self, store: WordStore):
+        '''Answers the next queries from store, see serving.use_store'''
+        engine = store.engine(self.engine_name, unique=True)    # None when the loop in findQuery is used
+        use_store(self, StoreView(store, store.word_set, store.unique_buckets, engine))   # buckets group words by length so a query only scans words that could match
+
+    def reload(self):
+        '''Loads the word list again and swaps it in, without dropping connected clients'''
+        reload_words(self)
 
     def checkWord(self, word: str, target: str) -> bool:
         '''Checks if a word matches the target pattern'''
@@ -39,21 +56,68 @@ class BasicServer():
             
         return True
 
-    def findQuery(self, target: str) -> tuple[list[str], int]:
+    def findQuery(self, target: str, view: StoreView | None=None) -> tuple[list[str], int]:
         '''Return all words matching the target pattern in the word set and the number of matches'''
+        view = view or self.view  # one word list for the whole query
+        if view.engine is not None:     # let the selected engine answer instead of scanning
+            return view.engine.find(target)
+
         word_list = []  # list of words that match the target pattern
         matches = 0     # number of words that match the target pattern
-        for word in self.word_set:
+        for word in view.word_buckets.get(len(target), []):    # only words of the target's length can match
             if self.checkWord(word, target):
                 word_list.append(word)
                 matches += 1
 
         return word_list, matches
 
+    def iterQuery(self, target: str, view: StoreView | None=None) -> Iterator[str]:
+        '''Yields the words matching the target pattern one at a time, for streaming replies'''
+        view = view or self.view  # one word list for the whole query
+        if view.engine is not None:
+            yield from view.engine.iter_matches(target)
+            return
+
+        for word in view.word_buckets.get(len(target), []):    # only words of the target's length can match
+            if self.checkWord(word, target):
+                yield word
+
+    def countQuery(self, target: str, view: StoreView | None=None) -> int:
+        '''Return the number of words matching the target pattern without building the list of words'''
+        view = view or self.view  # one word list for the whole query
+        if view.engine is not None:     # indexes count without allocating the matching words
+            return view.engine.count(target)
+
+        matches = 0
+        for word in view.word_buckets.get(len(target), []):    # only words of the target's length can match
+            if self.checkWord(word, target):
+                matches += 1
+
+        return matches
+
+    def batchQuery(self, targets: list[str], view: StoreView | None=None) -> list[tuple[list[str], int]]:
+        '''Return the matching words and number of matches of every target pattern, in order, see serving.batch_query'''
+        return batch_query(self, targets, view)
+
+    def getReply(self, query: str, compress: bool=False) -> bytes:
+        '''Returns the encoded reply to a client query, see serving.get_reply'''
+        return get_reply(self, query, compress)
+
+    def buildReply(self, command: str | None, pattern: str, view: StoreView | None=None) -> bytes:
+        '''Computes the encoded reply to a parsed query'''
+        return build_reply(self, command, pattern, view)
+
+    def stats(self) -> dict:
+        '''Returns the metrics of the server and its cache, answered to STATS queries'''
+        return server_stats(self)
+
     def handleClient(self, connection: socket):
         '''Handles single client connection'''
+        self.metrics.opened()
         try:
+            address = connection.getpeername()  # a client that reset the connection has no peer name anymore
             connection.send('200 OK'.encode())  # initial handshake to inform client that server is ready
+            compress = False    # until the client negotiates compression
             
             while True:
                 try:
@@ -63,20 +127,24 @@ class BasicServer():
                     break
                 if not data: break
 
-                words, matches = self.findQuery(data.decode())  # find all words matching the client's pattern query
-                
-                reply = f" (Total matches: {matches})\n"    # format reply message
-                if matches > 0:
-                    reply += ', '.join(words)
-                reply += '\n'
-                
-                connection.send(reply.encode()) # send reply to client
+                if data.startswith(PROTO_PREFIX):   # client upgrades the connection to the framed protocol
+                    serve_framed(connection, data, self.getReply)
+                    break
+
+                if data.startswith(COMPRESS_PREFIX):    # client asks for large replies to be compressed
+                    compress, answer = negotiate_compression(data)
+                    connection.sendall(answer)
+                    continue
+
+                for chunk in iter_reply(self, data.decode(), compress=compress):  # large replies are streamed in bounded chunks
+                    connection.sendall(chunk)
                 
-            print('Client at', connection.getpeername(), 'disconnected at', now())  # log disconnection of client and time
+            print('Client at', address, 'disconnected at', now())  # log disconnection of client and time
         
         finally:    # ensure connection is closed and logged
             print('Closing connection...')
             connection.close()  
+            self.metrics.closed()
 
     def dispatcher(self):
         '''Starts the server, listen for incoming connections, handle clients sequentially'''
@@ -95,7 +163,10 @@ class BasicServer():
             while True:
                 connection, address = client_socket.accept()    # accept incoming client connection
                 print(f'Server connected with {address} at {now()}')
-                self.handleClient(connection)        # handle client connection
+                try:
+                    self.handleClient(connection)        # handle client connection
+                except OSError as e:    # a client that went away must not stop the server
+                    print('Error handling client:', e)
                 print(f'Connection closed with {address} at {now()}.')
         except KeyboardInterrupt:
             print('Server shutting down...')
@@ -103,6 +174,16 @@ class BasicServer():
             client_socket.close()
             print('Server socket closed.')
 
+    def selectorDispatcher(self):
+        '''Starts the server on a selectors loop, handle many clients concurrently from one thread with non-blocking sockets'''
+        SelectorDispatcher(self).dispatcher()
+
 if __name__ == '__main__':
-    server = BasicServer()
-    server.dispatcher()
\ No newline at end of file
+    slow_ms = next((float(arg.split('=', 1)[1]) for arg in sys.argv if arg.startswith('--slow-ms=')), None)     # --slow-ms=N logs queries taking N ms or more
+    profile_dir = next((arg.split('=', 1)[1] for arg in sys.argv if arg.startswith('--profile-dir=')), tempfile.gettempdir())    # where PROFILE sessions write their files
+    server = BasicServer(slow_ms=slow_ms, profile_dir=profile_dir)
+    reload_on_signal(server.reload)     # "kill -HUP <pid>" reloads wordlist.txt without dropping clients
+    if '--selectors' in sys.argv:   # non-blocking single-threaded dispatcher instead of one client at a time
+        server.selectorDispatcher()
+    else:
+        server.dispatcher()
\ No newline at end of file
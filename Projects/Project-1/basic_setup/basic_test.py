@@ -1,14 +1,18 @@
 from basic_server import BasicServer
 from basic_client import BasicClient
+from query_cache import QueryCache
+from protocol import MAX_BATCH, split_batch
+import json
+import pstats
+import tracemalloc
+import threading
+from word_index import open_index
+from wordstore import get_store, load_store
 from socket import socket, AF_INET, SOCK_STREAM
 import pytest
 alphabet = "'()-./abcdefghijklmnopqrstuvwxyz"
 
-word_set = set()
-with open('../wordlist.txt', 'r') as f:
-    words = f.read().splitlines()
-    for word in words:
-        word_set.add(word)
+word_set = get_store().word_set
     
 def pattern_to_list(pattern: str) -> list[str]:
     possible_words = []
@@ -68,3 +72,204 @@ def test_checkWord_with_multiple_wildcards():
     test3 = 'b??k'
     check_output_is_possible_words(test3, findQuery(test3)[0])
         
+
+@pytest.mark.parametrize('engine', ['index', 'regex', 'numpy'])
+def test_engine_matches_loop(engine):
+    '''every engine must return exactly what the per-word loop returns'''
+    if engine == 'numpy':
+        pytest.importorskip('numpy')
+    loopServer = BasicServer(engine='loop')
+    engineServer = BasicServer(engine=engine)
+    
+    for pattern in ['cat', 'c?t', '??t', '?o?', 'b??k', '????????', '3422', '', 'x?????????????????????????????']:
+        loop_words, loop_matches = loopServer.findQuery(pattern)
+        engine_words, engine_matches = engineServer.findQuery(pattern)
+        assert sorted(engine_words) == sorted(loop_words)
+        assert engine_matches == loop_matches
+        assert engineServer.countQuery(pattern) == loopServer.countQuery(pattern) == loop_matches
+
+def test_unknown_engine():
+    with pytest.raises(ValueError):
+        BasicServer(engine='nope')
+
+def test_getReply_uses_cache():
+    cache = QueryCache()
+    testServer = BasicServer(cache=cache)
+    
+    reply = testServer.getReply('cat')
+    assert reply == b' (Total matches: 1)\ncat\n'
+    assert testServer.getReply('cat') is reply     # second query is served from the cache
+    assert (cache.hits, cache.misses) == (1, 1)
+    assert testServer.getReply('3422') == b' (Total matches: 0)\n\n'
+
+def test_cache_is_keyed_by_matching_semantics():
+    cache = QueryCache()
+    testServer = BasicServer(cache=cache)
+    testServer.getReply('')
+    loopServer = BasicServer(engine='loop', cache=cache)    # same word list, the cached replies are kept
+    assert cache.stats()['entries'] == 1
+    assert loopServer.cache_mode != testServer.cache_mode
+
+    cache.put(f'word all index {testServer.view.store.version.hex()}', '', b' (Total matches: 2)\n, \n')    # a server keeping duplicate words
+    assert testServer.getReply('') == b' (Total matches: 1)\n\n'
+
+def test_count_command():
+    testServer = BasicServer(cache=None)
+    
+    assert testServer.getReply('COUNT c?t') == b' (Total matches: 6)\n'
+    assert testServer.getReply('COUNT 3422\n') == b' (Total matches: 0)\n'
+    assert testServer.countQuery('b??k') == testServer.findQuery('b??k')[1]
+
+def test_stats_command_reports_metrics():
+    cache = QueryCache()
+    testServer = BasicServer(cache=cache)
+    for query in ['cat', 'cat', 'c?t', '???', 'COUNT c?t', 'c?t limit=-1']:
+        testServer.getReply(query)
+    
+    status, line = testServer.getReply('STATS').decode().splitlines()
+    stats = json.loads(line)
+    assert status == '200 STATS'
+    assert (stats['server'], stats['engine']) == ('BasicServer', 'index')
+    assert stats['requests'] == stats['queries']['exact']['requests'] + 4 == 6
+    assert stats['queries']['page']['errors'] == stats['errors'] == 1
+    assert sum(stats['queries']['only']['histogram']['counts']) == 1
+    assert stats['cache']['hits'] == 1
+    assert testServer.getReply('STATS') != testServer.getReply('STATS')    # never served from the cache
+
+def test_profile_command_writes_session_files(tmp_path):
+    testServer = BasicServer(cache=None, slow_ms=0, profile_dir=str(tmp_path))
+    
+    status, path = testServer.getReply('PROFILE cpu requests=2').decode().splitlines()
+    assert status == '200 PROFILE cpu started for 2 requests'
+    assert testServer.getReply('PROFILE memory').startswith(b'400 ')   # one session at a time
+    testServer.getReply('c?t')
+    testServer.getReply('COUNT b??k')
+    assert testServer.profiler.kind is None     # ended after its two queries
+    functions = {function for _, _, function in pstats.Stats(path).stats}
+    assert {'findQuery', 'countQuery'} <= functions
+    
+    _, path = testServer.getReply('PROFILE memory seconds=60').decode().splitlines()
+    testServer.getReply('????')
+    assert testServer.getReply('PROFILE stop').decode().splitlines() == ['200 PROFILE stopped', path]
+    assert tracemalloc.Snapshot.load(path).traces
+    for options in ['requests=0', 'seconds=inf', 'seconds=nan', 'seconds=-1', 'seconds=1e9']:
+        assert testServer.getReply(f'PROFILE cpu {options}').startswith(b'400 ')
+    assert testServer.profiler.kind is None
+    
+    assert [entry['query'] for entry in testServer.metrics.stats()['slow_queries']][:3] == ['PROFILE cpu requests=2', 'PROFILE memory', 'c?t']
+
+def test_paged_query_follows_cursor():
+    testServer = BasicServer(cache=None)
+    words, matches = testServer.findQuery('c?t')
+    
+    first = testServer.getReply('c?t limit=4').decode()
+    header, page = first.split('\n')[:2]
+    cursor = header.rsplit(' ', 1)[1].rstrip(')')
+    assert header.startswith(' (Page matches: 4,')
+    assert page == ', '.join(words[:4])
+    
+    second = testServer.getReply(f'c?t limit=4 cursor={cursor}')
+    assert second == f' (Page matches: {matches - 4}, next cursor: none)\n{", ".join(words[4:])}\n'.encode()
+    assert testServer.getReply('c?t limit=4 offset=4') == second
+    assert testServer.getReply(f'c??t limit=4 cursor={cursor}').startswith(b'400 ')   # cursor of another pattern
+    assert testServer.getReply('c?t limit=-1').startswith(b'400 ')
+    assert testServer.getReply('c?t limit=0').startswith(b'400 ')     # an empty page would never reach the end
+    assert testServer.getReply('c?t page=2').startswith(b'400 ')
+    assert testServer.getReply('c?t limit=\u00b2').startswith(b'400 ')   # a digit int() does not parse
+    assert testServer.getReply('COUNT c?t limit=2').startswith(b'400 ')
+
+def test_malformed_queries_answered_over_the_connection():
+    testServer = BasicServer(cache=None)
+    listener = socket(AF_INET, SOCK_STREAM)
+    listener.bind(('localhost', 0))
+    listener.listen(1)
+
+    def accept():
+        connection, _ = listener.accept()
+        listener.close()
+        testServer.handleClient(connection)
+
+    thread = threading.Thread(target=accept, daemon=True)
+    thread.start()
+    client = BasicClient(port=listener.getsockname()[1])
+    sock = client.connectToServer()
+    sock.settimeout(10)
+    try:
+        for query in ['c?t foo', 'COUNT cat x', 'BATCH', 'cat']:
+            sock.send(query.encode())
+            reply = sock.recv(1024)
+            while not reply.endswith(b'\n'):
+                reply += sock.recv(1024)
+            assert reply == testServer.getReply(query)
+            assert reply.startswith(b'400 ') == (query != 'cat')
+    finally:
+        client.closeConnection()
+    thread.join(10)
+    assert not thread.is_alive()
+
+@pytest.mark.parametrize('engine', ['loop', 'index'])
+def test_batch_matches_single_queries(engine):
+    testServer = BasicServer(engine=engine, cache=None)
+    patterns = ['c?t', 'b??k', 'cat', '3422', 'c?t', '??t']    # repeated patterns get their own reply
+    
+    reply = testServer.getReply('BATCH ' + ' '.join(patterns))
+    assert split_batch(reply) == [testServer.getReply(pattern) for pattern in patterns]
+    assert testServer.getReply('BATCH ' + 'a ' * (MAX_BATCH + 1)).startswith(b'400 ')
+    assert testServer.getReply('BATCH').startswith(b'400 ')    # an empty reply would leave the client waiting
+    assert testServer.getReply('BATCH ' + '???????? ' * 11).startswith(b'400 ')    # over MAX_BATCH_MATCHES, never built
+
+def test_cache_evicts_by_bytes():
+    cache = QueryCache(max_bytes=10)
+    cache.put('word', 'a', b'12345')
+    cache.put('word', 'b', b'12345')
+    cache.get('word', 'a')              # 'a' becomes the most recently used reply
+    cache.put('word', 'c', b'123')      # over budget, least recently used 'b' goes
+    
+    assert cache.get('word', 'b') is None
+    assert cache.get('word', 'a') == b'12345'
+    assert cache.stats()['bytes'] == 8
+    assert cache.evictions == 1
+    
+    cache.put('word', 'd', b'12345678901')  # larger than the whole budget, never stored
+    assert cache.get('word', 'd') is None
+    
+    cache.invalidate()
+    assert cache.get('word', 'a') is None
+    assert cache.stats()['entries'] == 0
+
+def test_word_index_rebuilds_when_stale(tmp_path):
+    wordlist = tmp_path / 'words.txt'
+    index_path = str(tmp_path / 'words.idx')
+    wordlist.write_text('cat\ncat\ndog\nbird\n')
+    
+    index = open_index(str(wordlist), index_path)
+    assert index.words() == ['cat', 'cat', 'dog', 'bird']
+    assert index.postings()[3][(0, 'd')] == 0b100    # IDs local to the length bucket, in word list order
+    assert index.postings(unique=True)[3][(0, 'd')] == 0b10    # BasicServer's distinct words
+    assert index.postings(unique=True)[4] == index.postings()[4]
+    index.close()
+    
+    wordlist.write_text('cat\ncow\n')   # new contents, so the saved index is stale
+    index = open_index(str(wordlist), index_path)
+    assert index.words() == ['cat', 'cow']
+    assert index.is_fresh(str(wordlist))
+    index.close()
+
+def test_useStore_swaps_word_list_of_servers_sharing_a_cache(tmp_path):
+    cache = QueryCache()
+    testServer = BasicServer(cache=cache)
+    otherServer = BasicServer(cache=cache)  # keeps the process-wide word list
+    assert testServer.getReply('c?t') == testServer.getReply('c?t')   # second query is a cache hit
+    old_view = testServer.view
+    
+    wordlist = tmp_path / 'words.txt'
+    wordlist.write_text('cat\ncot\ndog\n')
+    testServer.useStore(load_store(str(wordlist), str(tmp_path / 'words.idx')))
+    
+    assert testServer.getReply('c?t') == b' (Total matches: 2)\ncat, cot\n'
+    assert otherServer.getReply('c?t') == otherServer.buildReply(None, 'c?t')  # not the other list's reply
+    for _ in range(2):  # replies of either list cached after the swap are only served to its servers
+        assert otherServer.getReply('d?g') == otherServer.buildReply(None, 'd?g') != b' (Total matches: 1)\ndog\n'
+        assert testServer.getReply('d?g') == b' (Total matches: 1)\ndog\n'
+    assert testServer.countQuery('c?t', old_view) == len(testServer.findQuery('c?t', old_view)[0]) == 6  # a query holding the old view still sees the old list
+    assert testServer.stats()['version'] == testServer.view.store.version.hex() != old_view.store.version.hex()
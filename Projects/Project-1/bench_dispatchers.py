@@ -0,0 +1,46 @@
+'''Measures the query throughput of every dispatcher with many concurrent clients
+
+Each dispatcher runs in its own process on a free port and is loaded by bench_load's closed-loop
+clients, which replay the default pattern mix for a few seconds per level of concurrency.
+'''
+import sys
+from bench_load import DEFAULT_MIX, free_port, make_workload, parse_mix, run_load, start_server
+
+VARIANTS = {    # name: (server, dispatcher)
+    'basic': ('basic', 'default'),
+    'thread': ('thread', 'default'),
+    'async': ('thread', 'async'),
+    'selectors': ('thread', 'selectors'),
+}
+
+def measure(name: str, clients: int, workload: list[tuple[str, str]], duration: float=3.0) -> dict:
+    '''Returns the bench_load results of one dispatcher for the given number of concurrent clients'''
+    port = free_port()
+    server = start_server(*VARIANTS[name], port)
+    try:
+        return run_load(port, clients, duration, workload)
+    finally:
+        server.kill()
+        server.join()
+
+def describe(results: dict) -> str:
+    '''Formats queries per second and how many clients were left out.
+
+    A dispatcher that accepts one client at a time lets a small listen backlog overflow, and the
+    kernel then drops handshakes the clients believe complete: those clients time out.
+    '''
+    if results['errors']:
+        return 'timed out'
+    cell = f"{results['qps']:.0f}"
+    waiting = results['shed_clients'] + results['idle_clients']
+    if waiting:
+        cell += f' ({waiting} unserved)'   # shed, or still waiting for a thread when the run ended
+    return cell
+
+if __name__ == '__main__':
+    levels = [int(arg) for arg in sys.argv[1:]] or [1, 16, 128]
+    workload = make_workload(parse_mix(DEFAULT_MIX), 1000, seed=3300)
+    print(f'Queries per second of closed-loop clients replaying the mix {DEFAULT_MIX}:')
+    print(f"{'clients':>8}" + ''.join(f'{name:>22}' for name in VARIANTS))
+    for clients in levels:
+        print(f'{clients:>8}' + ''.join(f'{describe(measure(name, clients, workload)):>22}' for name in VARIANTS), flush=True)
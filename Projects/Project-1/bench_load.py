@@ -0,0 +1,279 @@
+'''Load generator reporting the throughput and latency of a word server under concurrent clients
+
+The server runs in its own process on a free port, so the clients (threads of this process) do not
+share its interpreter lock. Each client holds one connection and replays the pattern mix in a closed
+loop, sending a query as soon as the reply to the previous one is read in full, until the run ends.
+The run reports queries per second and latency percentiles, overall and per kind of pattern, and can
+save them as JSON and compare them with a previous run:
+
+    python bench_load.py --server=extra --clients=32 --duration=10 --json=extra.json
+    python bench_load.py --server=extra --clients=32 --duration=10 --compare=extra.json
+    python bench_load.py --server=thread --processes=4 --clients=32
+'''
+import argparse, contextlib, json, multiprocessing, os, platform, random, signal, sys, threading, time
+from socket import socket, AF_INET, SOCK_STREAM, create_connection
+
+ROOT = os.path.dirname(os.path.abspath(__file__))
+sys.path += [os.path.join(ROOT, 'basic_setup'), os.path.join(ROOT, 'threaded_setup'), os.path.join(ROOT, 'Extra')]
+from basic_server import BasicServer
+from thread_server import ThreadServer
+from Extra_server import ExtraServer
+from wordstore import get_store
+
+SERVERS = {'basic': BasicServer, 'thread': ThreadServer, 'extra': ExtraServer}
+DISPATCHERS = {     # name: the server method serving clients until the process is terminated
+    'default': 'dispatcher',
+    'async': 'asyncDispatcher',
+    'selectors': 'selectorDispatcher',
+}
+KINDS = ('exact', 'few', 'all', 'substring')    # kinds of patterns in a mix, see make_patterns
+DEFAULT_MIX = 'exact:4,few:4,all:1,substring:1'
+
+def parse_mix(mix: str) -> dict[str, int]:
+    '''Parses "kind:weight,..." into the weight of each kind of pattern'''
+    weights = {}
+    for item in mix.split(','):
+        kind, _, weight = item.partition(':')
+        if kind not in KINDS:
+            raise ValueError(f'unknown pattern kind {kind!r}, expected one of {", ".join(KINDS)}')
+        weights[kind] = int(weight or 1)
+    return weights
+
+def make_patterns(kind: str, count: int, rng: random.Random) -> list[str]:
+    '''Returns count patterns of one kind, drawn from the word list:
+
+    exact       whole words
+    few         whole words with one or two letters replaced by '?'
+    all         only wildcards, 2 to 8 of them
+    substring   2 to 4 letter pieces of words, some with a wildcard
+    '''
+    words = [word for word in get_store().unique_words if len(word) >= 4]
+    patterns = []
+    for _ in range(count):
+        word = rng.choice(words)
+        if kind == 'exact':
+            patterns.append(word)
+        elif kind == 'few':
+            letters = list(word)
+            for i in rng.sample(range(len(letters)), min(len(letters), rng.choice((1, 2)))):
+                letters[i] = '?'
+            patterns.append(''.join(letters))
+        elif kind == 'all':
+            patterns.append('?' * rng.randint(2, 8))
+        else:
+            size = rng.randint(2, 4)
+            start = rng.randrange(len(word) - size + 1)
+            piece = list(word[start:start + size])
+            if size > 2 and rng.random() < 0.5:
+                piece[rng.randrange(size)] = '?'
+            patterns.append(''.join(piece))
+    return patterns
+
+def make_workload(weights: dict[str, int], size: int, seed: int) -> list[tuple[str, str]]:
+    '''Returns size (kind, pattern) queries mixed by weight in a shuffled, reproducible order'''
+    rng = random.Random(seed)
+    total = sum(weights.values())
+    workload = []
+    for kind, weight in weights.items():
+        workload += [(kind, pattern) for pattern in make_patterns(kind, max(1, size * weight // total), rng)]
+    rng.shuffle(workload)
+    return workload
+
+def free_port() -> int:
+    '''Returns a port nothing listens on right now'''
+    with socket(AF_INET, SOCK_STREAM) as sock:
+        sock.bind(('localhost', 0))
+        return sock.getsockname()[1]
+
+def serve_quietly(server: str, dispatcher: str, port: int, options: dict):
+    '''Runs a server without its per-connection logging, until it is terminated'''
+    signal.signal(signal.SIGTERM, signal.default_int_handler)   # shut down as on Ctrl-C, stopping any worker processes
+    with open(os.devnull, 'w') as devnull, contextlib.redirect_stdout(devnull):
+        getattr(SERVERS[server](port=port, **options), DISPATCHERS[dispatcher])()
+
+def start_server(server: str, dispatcher: str, port: int, options: dict | None=None) -> multiprocessing.Process:
+    '''Starts a server in a child process and waits until it is ready, stop_server stops it.
+
+    The process is not a daemon, as daemons can not start the query worker processes of ThreadServer.
+    '''
+    if not hasattr(SERVERS[server], DISPATCHERS[dispatcher]):
+        raise ValueError(f'{server} has no {dispatcher} dispatcher')
+    context = multiprocessing.get_context('fork' if 'fork' in multiprocessing.get_all_start_methods() else None)
+    process = context.Process(target=serve_quietly, args=(server, dispatcher, port, options or {}))
+    process.start()
+    try:
+        wait_until_listening(port)
+    except BaseException:
+        stop_server(process)
+        raise
+    return process
+
+def stop_server(process: multiprocessing.Process, timeout: float=10.0):
+    '''Terminates a server process, killing it when it has not shut down within timeout seconds'''
+    process.terminate()
+    process.join(timeout)
+    if process.is_alive():
+        process.kill()
+        process.join()
+
+def wait_until_listening(port: int, timeout: float=30.0):
+    '''Waits until the server completes a handshake, the word list may still be loading'''
+    deadline = time.monotonic() + timeout
+    while True:
+        try:
+            with create_connection(('localhost', port), timeout=timeout) as sock:
+                if sock.recv(6) == b'200 OK':
+                    return
+        except OSError:
+            if time.monotonic() > deadline:
+                raise
+            time.sleep(0.05)
+
+def read_reply(sock: socket) -> bytes:
+    '''Reads one full reply, the header line and the line of words'''
+    reply = b''
+    while reply.count(b'\n') < 2:
+        data = sock.recv(65536)
+        if not data:
+            raise ConnectionError('Server closed the connection')
+        reply += data
+    return reply
+
+class LoadClient(threading.Thread):
+    '''One connection replaying the workload from its own offset until the deadline, timing every query'''
+    def __init__(self, port: int, workload: list[tuple[str, str]], offset: int, deadline: float, timeout: float):
+        super().__init__(daemon=True)
+        self.port = port
+        self.workload = workload
+        self.offset = offset
+        self.deadline = deadline
+        self.timeout = timeout
+        self.latencies: dict[str, list[float]] = {kind: [] for kind in KINDS}
+        self.shed = False
+        self.error: Exception | None = None
+
+    def run(self):
+        try:
+            with create_connection(('localhost', self.port), timeout=self.timeout) as sock:
+                handshake = sock.recv(6)
+                if handshake.startswith(b'503'):    # the server is saturated and told this client to retry later
+                    self.shed = True
+                    return
+                if handshake != b'200 OK':
+                    raise ConnectionError(f'Unexpected handshake {handshake!r}')
+
+                i = self.offset
+                while time.perf_counter() < self.deadline:
+                    kind, pattern = self.workload[i % len(self.workload)]
+                    start = time.perf_counter()
+                    sock.send(pattern.encode())
+                    read_reply(sock)
+                    self.latencies[kind].append(time.perf_counter() - start)
+                    i += 1
+        except Exception as e:
+            self.error = e
+
+def percentiles(latencies: list[float]) -> dict[str, float]:
+    '''Returns the count, mean, p50, p95, p99 and maximum of latencies, in milliseconds'''
+    if not latencies:
+        return {'count': 0}
+    ordered = sorted(latencies)
+    at = lambda q: ordered[min(len(ordered) - 1, int(q * len(ordered)))] * 1000
+    return {
+        'count': len(ordered),
+        'mean_ms': sum(ordered) / len(ordered) * 1000,
+        'p50_ms': at(0.50),
+        'p95_ms': at(0.95),
+        'p99_ms': at(0.99),
+        'max_ms': ordered[-1] * 1000,
+    }
+
+def run_load(port: int, clients: int, duration: float, workload: list[tuple[str, str]], timeout: float=10.0) -> dict:
+    '''Runs clients concurrent connections against the server for duration seconds, returns the results'''
+    start = time.perf_counter()
+    deadline = start + duration
+    threads = [LoadClient(port, workload, i * len(workload) // clients, deadline, timeout) for i in range(clients)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join(duration + timeout + 5)
+    elapsed = time.perf_counter() - start
+
+    by_kind = {kind: [latency for thread in threads for latency in thread.latencies[kind]] for kind in KINDS}
+    every = [latency for latencies in by_kind.values() for latency in latencies]
+    errors = [thread.error for thread in threads if thread.error is not None]
+    return {
+        'queries': len(every),
+        'seconds': elapsed,
+        'qps': len(every) / elapsed,
+        'latency': percentiles(every),
+        'by_kind': {kind: percentiles(latencies) for kind, latencies in by_kind.items() if latencies},
+        'shed_clients': sum(thread.shed for thread in threads),
+        'idle_clients': sum(not thread.shed and thread.error is None and not any(thread.latencies.values()) for thread in threads),
+        'errors': len(errors),
+        'first_error': repr(errors[0]) if errors else None,
+    }
+
+def print_results(results: dict, baseline: dict | None=None):
+    '''Prints the throughput and latencies, with the change from a baseline run when given'''
+    def change(value: float, old: float | None) -> str:
+        return f' ({(value - old) / old * 100:+6.1f}%)' if old else ''
+
+    old = baseline or {}
+    print(f"{results['queries']} queries in {results['seconds']:.1f} s, {results['qps']:.0f} queries/s"
+          + change(results['qps'], old.get('qps')))
+    if results['shed_clients'] or results['errors'] or results['idle_clients']:
+        print(f"{results['shed_clients']} clients shed, {results['idle_clients']} never served before the end,"
+              f" {results['errors']} failed {results['first_error'] or ''}")
+    rows = [('total', results['latency'], old.get('latency', {}))]
+    rows += [(kind, stats, old.get('by_kind', {}).get(kind, {})) for kind, stats in results['by_kind'].items()]
+    print(f"{'':>10}{'count':>9}" + ''.join(f'{title:>10}{"":12}' for title in ('p50 ms', 'p95 ms', 'p99 ms')))
+    for name, stats, before in rows:
+        if not stats.get('count'):
+            continue
+        cells = ''.join(f'{stats[key]:>10.2f}{change(stats[key], before.get(key)):<12}' for key in ('p50_ms', 'p95_ms', 'p99_ms'))
+        print(f"{name:>10}{stats['count']:>9}{cells}")
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Concurrent load and latency benchmark of the word servers')
+    parser.add_argument('--server', choices=SERVERS, default='thread')
+    parser.add_argument('--dispatcher', choices=DISPATCHERS, default='default')
+    parser.add_argument('--engine', help='matching engine of the server, its default when omitted')
+    parser.add_argument('--processes', type=int, default=0, help='query worker processes of the thread server')
+    parser.add_argument('--clients', type=int, default=16, help='concurrent connections')
+    parser.add_argument('--duration', type=float, default=5.0, help='seconds of load')
+    parser.add_argument('--mix', default=DEFAULT_MIX, help=f'weights of the pattern kinds {", ".join(KINDS)}')
+    parser.add_argument('--patterns', type=int, default=1000, help='distinct queries in the workload')
+    parser.add_argument('--seed', type=int, default=3300)
+    parser.add_argument('--json', help='file to save the results to')
+    parser.add_argument('--compare', help='results file of an earlier run to compare with')
+    args = parser.parse_args()
+    if args.processes and args.server != 'thread':
+        parser.error('--processes needs --server=thread')
+
+    options = {'engine': args.engine} if args.engine else {}
+    if args.processes:
+        options['processes'] = args.processes
+    workload = make_workload(parse_mix(args.mix), args.patterns, args.seed)
+    port = free_port()
+    server = start_server(args.server, args.dispatcher, port, options)
+    try:
+        results = run_load(port, args.clients, args.duration, workload)
+    finally:
+        stop_server(server)
+
+    config = {key: value for key, value in vars(args).items() if key not in ('json', 'compare')}
+    report = {'config': config, 'machine': {'python': platform.python_version(), 'cpus': os.cpu_count()}, 'time': time.time(), **results}
+    baseline = None
+    if args.compare:
+        with open(args.compare) as file:
+            baseline = json.load(file)
+        if baseline.get('config') != config:
+            print(f"Note: the baseline ran with {baseline.get('config')}")
+
+    print(f'{args.server} server, {args.dispatcher} dispatcher, {args.clients} clients, mix {args.mix}:')
+    print_results(results, baseline)
+    if args.json:
+        with open(args.json, 'w') as file:
+            json.dump(report, file, indent=2)
+        print(f'Saved results to {args.json}')
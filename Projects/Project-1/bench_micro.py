@@ -0,0 +1,147 @@
+'''Micro-benchmarks of the matchers of every server, failing when they regress against a stored baseline
+
+Every case times one operation over the real word list: checkWord and checkSubstring over a fixed
+sample of words, and findQuery of each server with its per-word loop and with its default engine,
+for the patterns the tests use. A case records the best time per operation over a few repeats and
+the peak memory one operation allocates.
+
+    python bench_micro.py --save=bench_baseline.json     # record a baseline on this machine
+    python bench_micro.py --check=bench_baseline.json    # exit 1 if a case got slower than the margin
+
+Timings only compare across runs on the same machine, so the baseline is not kept in the repository.
+'''
+import argparse, json, os, platform, random, sys, timeit, tracemalloc
+
+ROOT = os.path.dirname(os.path.abspath(__file__))
+sys.path += [os.path.join(ROOT, 'basic_setup'), os.path.join(ROOT, 'threaded_setup'), os.path.join(ROOT, 'Extra')]
+from basic_server import BasicServer
+from thread_server import ThreadServer
+from Extra_server import ExtraServer
+from engines import ENGINES
+from wordstore import get_store
+
+WORD_PATTERNS = ['cat', 'c?t', '??t', '?o?', 'b??k', '????????', '3422', '', 'x?????????????????????????????']   # basic_test.py
+SUBSTRING_PATTERNS = ['?', '?(a)', '-?-', '??????????', 'c?t', 'a.b', 'a', '', 'zzzz', 'ing?', 'quick', '?ing?', 'e?e?e']   # Extra_test.py
+SERVERS = [     # name, server class, default engine, patterns
+    ('basic', BasicServer, 'index', WORD_PATTERNS),
+    ('thread', ThreadServer, 'index', WORD_PATTERNS),
+    ('extra', ExtraServer, 'ngram', SUBSTRING_PATTERNS),
+]
+SAMPLE_SIZE = 1000  # words checkWord and checkSubstring are timed over
+
+def make_cases(engines: list[str] | None=None) -> dict:
+    '''Returns each case name mapped to the function running one operation of it.
+
+    engines selects the engines findQuery is timed with, the loop and each server's default when None.
+    Engines a server can not run, for its matching mode or a missing optional dependency, are skipped.
+    '''
+    sample = random.Random(3300).sample(get_store().words, SAMPLE_SIZE)
+    cases = {}
+    for name, server_class, default, patterns in SERVERS:
+        loop = server_class(engine='loop', cache=None)
+        for pattern in patterns:
+            cases[f'{name}.checkWord {pattern!r}'] = lambda check=loop.checkWord, pattern=pattern: [check(word, pattern) for word in sample]
+        if name == 'extra':
+            for pattern in patterns:
+                windows = [word[:len(pattern)] for word in sample if len(word) >= len(pattern)]
+                cases[f'{name}.checkSubstring {pattern!r}'] = lambda check=loop.checkSubstring, pattern=pattern, windows=windows: [check(window, pattern) for window in windows]
+
+        for engine in engines or ['loop', default]:
+            try:
+                server = server_class(engine=engine, cache=None)
+            except (ImportError, ValueError):   # optional dependency not installed, or an engine of the other matching mode
+                continue
+            for pattern in patterns:
+                cases[f'{name}.findQuery[{engine}] {pattern!r}'] = lambda find=server.findQuery, pattern=pattern: find(pattern)
+    return cases
+
+def measure(run, repeat: int=3) -> dict[str, float]:
+    '''Returns the best seconds per call of run over repeat timings, and the peak bytes one call allocates'''
+    timer = timeit.Timer(run)
+    number, _ = timer.autorange()   # enough calls per timing to take at least 0.2 seconds
+    seconds = min(timer.repeat(repeat=repeat, number=number)) / number
+
+    tracemalloc.start()
+    run()
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    return {'seconds': seconds, 'peak_bytes': peak}
+
+def reference():
+    '''Fixed pure-Python work, timed to tell a machine running slower from code running slower'''
+    for word in ('abcdefghij', 'klmnopqrst') * 200:
+        all(p == '?' or p == c for c, p in zip(word, 'a?c?e?g?i?'))
+
+def exceeded(result: dict, before: dict, margin: float, slowdown: float=1.0) -> list[str]:
+    '''Returns the measures of a case beyond its baseline by more than margin.
+
+    slowdown is how much slower the machine runs the reference than when the baseline was saved,
+    the baseline time is scaled by it (never below 1) before comparing.
+    '''
+    limits = {'seconds': before['seconds'] * max(1.0, slowdown) * (1 + margin),
+              'peak_bytes': before['peak_bytes'] * (1 + margin) + 1024}    # allocation peaks vary by a few hundred bytes
+    return [key for key, limit in limits.items() if result[key] > limit]
+
+def regressions(cases: dict, results: dict, baseline: dict, margin: float, retries: int=2) -> list[str]:
+    '''Returns a description of every case slower, or allocating more, than baseline by more than margin.
+
+    A case over the margin is measured again up to retries times between two timings of the reference,
+    keeping its best time, so contention on a shared machine is not reported as a regression. The
+    faster reference timing sets the slowdown, so a burst of contention during one of them can not
+    hide a real regression.
+    '''
+    found = []
+    for case, result in results.items():
+        before = baseline['cases'].get(case)
+        if before is None:
+            continue
+        slowdown = 1.0
+        for _ in range(retries):
+            if 'seconds' not in exceeded(result, before, margin, slowdown):
+                break
+            ahead = measure(reference)['seconds']
+            result['seconds'] = min(result['seconds'], measure(cases[case])['seconds'])
+            slowdown = min(ahead, measure(reference)['seconds']) / baseline['reference']
+        for key in exceeded(result, before, margin, slowdown):
+            found.append(f'{case}: {key} {before[key]:.4g} -> {result[key]:.4g} ({(result[key] / max(before[key], 1e-12) - 1) * 100:+.0f}%)')
+    return found
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Micro-benchmarks of the word servers matchers')
+    parser.add_argument('--only', help='run the cases whose name contains this text')
+    parser.add_argument('--engines', help=f'comma separated engines to time findQuery with, or "all" for {", ".join(ENGINES)}')
+    parser.add_argument('--repeat', type=int, default=3)
+    parser.add_argument('--save', help='file to save the results to as the new baseline')
+    parser.add_argument('--check', help='baseline file to compare with, exits 1 on a regression')
+    parser.add_argument('--margin', type=float, default=0.25, help='slowdown tolerated before failing, 0.25 is 25%%')
+    args = parser.parse_args()
+
+    engines = list(ENGINES) if args.engines == 'all' else args.engines.split(',') if args.engines else None
+    if unknown := set(engines or ()) - set(ENGINES):
+        parser.error(f'unknown engines {", ".join(sorted(unknown))}, expected some of {", ".join(ENGINES)}')
+    cases = {case: run for case, run in make_cases(engines).items() if not args.only or args.only in case}
+    baseline = {'cases': {}}
+    if args.check:
+        with open(args.check) as file:
+            baseline = json.load(file)
+
+    results = {}
+    print(f"{'case':<62}{'us/op':>12}{'peak KiB':>10}{'vs baseline':>13}")
+    for case, run in cases.items():
+        results[case] = measure(run, args.repeat)
+        before = baseline['cases'].get(case)
+        change = f"{(results[case]['seconds'] / before['seconds'] - 1) * 100:+.1f}%" if before else ''
+        print(f"{case:<62}{results[case]['seconds'] * 1e6:>12.2f}{results[case]['peak_bytes'] / 1024:>10.1f}{change:>13}", flush=True)
+
+    if args.save:
+        with open(args.save, 'w') as file:
+            machine = {'python': platform.python_version(), 'cpus': os.cpu_count()}
+            json.dump({'machine': machine, 'reference': measure(reference)['seconds'], 'cases': results}, file, indent=2)
+        print(f'Saved baseline to {args.save}')
+
+    if args.check:
+        found = regressions(cases, results, baseline, args.margin)
+        for line in found:
+            print('REGRESSION', line)
+        print(f'{len(found)} regressions beyond {args.margin:.0%} in {len(results)} cases')
+        sys.exit(1 if found else 0)
@@ -0,0 +1,59 @@
+'''Measures streamed against fully built replies for a broad ExtraServer pattern
+
+For each path the reply to the pattern is sent over a local socket pair while a thread drains it,
+recording the time to the first byte and the total time, then the peak memory traced while sending
+in a second run (tracing slows allocations down, so it is kept out of the timed run).
+'''
+import os, sys, threading, time, tracemalloc
+from socket import socketpair
+
+ROOT = os.path.dirname(os.path.abspath(__file__))
+sys.path.append(os.path.join(ROOT, 'Extra'))
+from Extra_server import ExtraServer
+from protocol import iter_reply
+
+def drain(sock, first_byte: list[float]):
+    '''Reads until the peer closes, recording when the first byte arrived'''
+    while data := sock.recv(1 << 16):
+        if not first_byte:
+            first_byte.append(time.perf_counter())
+
+def send_once(send_reply, pattern: str) -> tuple[float, float]:
+    '''Sends the reply to the pattern with send_reply(connection, pattern), returns the seconds to the first byte and in total'''
+    server_side, client_side = socketpair()
+    first_byte: list[float] = []
+    reader = threading.Thread(target=drain, args=(client_side, first_byte))
+    reader.start()
+
+    start = time.perf_counter()
+    send_reply(server_side, pattern)
+    server_side.close()
+    reader.join()
+    total = time.perf_counter() - start
+    client_side.close()
+    return first_byte[0] - start, total
+
+def measure(send_reply, pattern: str) -> dict[str, float]:
+    '''Returns the timings of sending the reply to the pattern and the peak memory it allocated'''
+    first_byte, total = send_once(send_reply, pattern)
+    tracemalloc.start()
+    send_once(send_reply, pattern)
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    return {'first_byte_ms': first_byte * 1000, 'total_ms': total * 1000, 'peak_kib': peak / 1024}
+
+if __name__ == '__main__':
+    pattern = sys.argv[1] if len(sys.argv) > 1 else '?'
+    server = ExtraServer(cache=None)
+
+    def built(connection, pattern):
+        connection.sendall(server.getReply(pattern))
+
+    def streamed(connection, pattern):
+        for chunk in iter_reply(server, pattern):
+            connection.sendall(chunk)
+
+    print(f'Reply to {pattern!r} on ExtraServer ({server.countQuery(pattern)} matches):')
+    for name, send_reply in [('built', built), ('streamed', streamed)]:
+        result = measure(send_reply, pattern)
+        print(f"{name:>9}: first byte {result['first_byte_ms']:7.2f} ms, total {result['total_ms']:7.2f} ms, peak {result['peak_kib']:8.1f} KiB")
@@ -0,0 +1,81 @@
+'''Matching engines the word servers can run findQuery on, selected by name at server construction'''
+import os, sys, time
+from positional_index import PositionalIndex
+from ngram_index import NgramIndex
+from suffix_array import SuffixArrayIndex
+from word_index import WordIndex
+from regex_engine import RegexEngine
+
+ENGINES = ('loop', 'index', 'regex', 'ngram', 'suffix', 'numpy')
+
+def make_engine(name: str, words: list[str], substring: bool=False, word_index: WordIndex | None=None, unique: bool=False):
+    '''Builds the named engine over the words, or returns None for the servers' own "loop" engine.
+
+    substring selects the unanchored matching of ExtraServer instead of whole-word matching. Engines
+    reuse what the memory-mapped word_index already holds instead of building it again; unique tells
+    them words are its distinct words rather than the whole word list.
+    '''
+    if name == 'loop':
+        return None
+
+    if name == 'index':
+        if substring:
+            raise ValueError('The "index" engine only supports whole-word matching')
+        if word_index is not None and word_index.posting_count:    # saved bitsets follow the index's word order
+            return PositionalIndex(words, word_index.postings(unique))
+        return PositionalIndex(words)
+
+    if name == 'regex':
+        return RegexEngine(words, substring)
+
+    if name == 'ngram':
+        if not substring:
+            raise ValueError('The "ngram" engine only supports substring matching')
+        return NgramIndex(words)
+
+    if name == 'suffix':
+        if not substring:
+            raise ValueError('The "suffix" engine only supports substring matching')
+        return SuffixArrayIndex.load(words)     # saved by running suffix_array.py, rebuilt if stale
+
+    if name == 'numpy':
+        from numpy_engine import NumpyEngine    # numpy is optional, only needed by this engine
+        return NumpyEngine(words, substring)
+
+    raise ValueError(f'Unknown engine {name!r}, expected one of {", ".join(ENGINES)}')
+
+def compare_engines(make_server, patterns: list[str], engines: list[str], repeat: int=5) -> dict[str, float]:
+    '''Times findQuery of make_server(engine) for every engine and prints its speedup over the "loop" engine
+
+    Returns the average seconds per query of each engine.
+    '''
+    timings = {}
+    for name in ['loop'] + [e for e in engines if e != 'loop']:
+        findQuery = make_server(name).findQuery
+        start = time.perf_counter()
+        for _ in range(repeat):
+            for pattern in patterns:
+                findQuery(pattern)
+        timings[name] = (time.perf_counter() - start) / (repeat * len(patterns))
+
+    for name, seconds in timings.items():
+        print(f'{name:>8}: {seconds * 1000:8.3f} ms/query  ({timings["loop"] / seconds:6.1f}x vs loop)')
+    return timings
+
+if __name__ == '__main__':  # report the speedup of every engine over the servers' per-word loops
+    root = os.path.dirname(os.path.abspath(__file__))
+    sys.path += [os.path.join(root, 'basic_setup'), os.path.join(root, 'Extra')]
+    os.chdir(os.path.join(root, 'Extra'))   # servers load ../wordlist.txt relative to their own directory
+    from basic_server import BasicServer
+    from Extra_server import ExtraServer
+
+    try:
+        import numpy
+        optional = ['numpy']
+    except ImportError:
+        optional = []
+
+    print('Whole-word mode (BasicServer):')
+    compare_engines(lambda engine: BasicServer(engine=engine), ['cat', 'c?t', '??t', '?o?', 'b??k', '??????????'], ['index', 'regex'] + optional)
+    print('Substring mode (ExtraServer):')
+    compare_engines(lambda engine: ExtraServer(engine=engine), ['?', '?(a)', '-?-', '??????????'], ['regex', 'ngram', 'suffix'] + optional)
@@ -0,0 +1,274 @@
+'''Versioned, length-prefixed binary framing for the word servers, with request pipelining
+
+A client upgrades a legacy text connection by sending "PROTO 1" (optionally followed by a newline and
+its first frames) after the "200 OK" handshake; the server answers "200 PROTO 1\n" and from then on
+both sides exchange frames:
+
+    version (u8) | opcode (u8) | flags (u16) | request ID (u32) | payload length (u32) | payload
+
+Requests carry a pattern as payload, replies echo the request ID with the RESPONSE bit set on the
+opcode and carry the same bytes a text reply would. Clients may send many requests without waiting
+and match the replies by ID, so a query is never split or merged the way recv(1024) messages are.
+'''
+import itertools
+import json
+import socket
+import struct
+from protocol import COUNT, BATCH, STATS, COMMANDS, QueryError, encode_error, split_batch, parse_busy
+
+VERSION = 1
+HEADER = struct.Struct('!BBHII')
+PROTO_PREFIX = b'PROTO '
+MAX_PAYLOAD = 64 * 1024     # largest request accepted, replies are not limited
+
+QUERY = 0x01    # payload: pattern, reply: " (Total matches: N)\n" and the words
+COUNT_QUERY = 0x02  # payload: pattern, reply: " (Total matches: N)\n"
+BATCH_QUERY = 0x03  # payload: whitespace separated patterns, reply: the QUERY reply of each pattern in order
+STATS_QUERY = 0x04  # payload: empty, reply: "200 STATS\n" and the server's metrics as one line of JSON
+ERROR = 0x7F    # reply payload: error message
+RESPONSE = 0x80     # set on the opcode of every reply
+
+class FramingError(Exception):
+    '''Raised when the peer sends something that is not a valid frame'''
+
+class ServerBusy(ConnectionError):
+    '''Raised when the server sheds the connection with "503 BUSY" instead of the handshake'''
+    def __init__(self, retry_after: float):
+        super().__init__(f'Server busy, retry after {retry_after:g} seconds')
+        self.retry_after = retry_after
+
+def encode_frame(opcode: int, request_id: int, payload: bytes, flags: int=0) -> bytes:
+    '''Returns the header and payload of one frame'''
+    return HEADER.pack(VERSION, opcode, flags, request_id, len(payload)) + payload
+
+def decode_header(header: bytes) -> tuple[int, int, int, int]:
+    '''Returns the opcode, flags, request ID and payload length of a frame header'''
+    version, opcode, flags, request_id, length = HEADER.unpack(header)
+    if version != VERSION:
+        raise FramingError(f'Unsupported frame version {version}')
+    return opcode, flags, request_id, length
+
+def request_query(opcode: int, payload: bytes) -> str:
+    '''Turns a request frame into the text query getReply understands.
+
+    The payload of a QUERY or COUNT_QUERY is one pattern and never read as a command or options, so a
+    payload getReply would parse as more than a pattern is a QueryError.
+    '''
+    pattern = payload.decode()
+    if opcode in (QUERY, COUNT_QUERY) and (len(pattern.split()) > 1 or opcode == QUERY and pattern.strip() in COMMANDS):
+        raise QueryError(f'the payload of a query frame is a single pattern, got {pattern!r}')
+    if opcode == QUERY:
+        return pattern
+    if opcode == COUNT_QUERY:
+        return f'{COUNT} {pattern}'
+    if opcode == BATCH_QUERY:
+        return f'{BATCH} {pattern}'
+    if opcode == STATS_QUERY:
+        return STATS
+    raise FramingError(f'Unknown opcode {opcode:#x}')
+
+def parse_upgrade(data: bytes) -> tuple[int | None, bytes]:
+    '''Returns the version asked for by a "PROTO <version>" line and the bytes received after it'''
+    line, _, rest = data.partition(b'\n')
+    try:
+        return int(line[len(PROTO_PREFIX):].strip()), rest
+    except ValueError:
+        return None, rest
+
+class FrameReader():
+    '''Reads whole frames from a blocking socket, however TCP splits or merges them'''
+    def __init__(self, connection: socket.socket, buffer: bytes=b''):
+        self.connection = connection
+        self.buffer = bytearray(buffer)
+
+    def read_exactly(self, size: int) -> bytes | None:
+        '''Returns the next size bytes, or None if the peer closed the connection first'''
+        while len(self.buffer) < size:
+            data = self.connection.recv(max(65536, size - len(self.buffer)))
+            if not data:
+                return None
+            self.buffer += data
+        chunk = bytes(self.buffer[:size])
+        del self.buffer[:size]
+        return chunk
+
+    def read_frame(self, max_payload: int | None=None) -> tuple[int, int, int, bytes] | None:
+        '''Returns the opcode, flags, request ID and payload of the next frame, None at end of stream'''
+        header = self.read_exactly(HEADER.size)
+        if header is None:
+            return None
+        opcode, flags, request_id, length = decode_header(header)
+        if max_payload is not None and length > max_payload:
+            raise FramingError(f'Frame of {length} bytes is too large')
+        payload = self.read_exactly(length)
+        if payload is None:
+            return None
+        return opcode, flags, request_id, payload
+
+def answer_frame(opcode: int, request_id: int, payload: bytes, get_reply) -> bytes:
+    '''Returns the reply frame to one request frame, an ERROR frame when the request is malformed'''
+    try:
+        return encode_frame(opcode | RESPONSE, request_id, get_reply(request_query(opcode, payload)))
+    except QueryError as e:     # answered like a malformed text query
+        return encode_frame(opcode | RESPONSE, request_id, encode_error(str(e)))
+    except (FramingError, UnicodeDecodeError) as e:     # bad request, the connection stays usable
+        return encode_frame(ERROR | RESPONSE, request_id, str(e).encode())
+
+def serve_framed(connection: socket.socket, data: bytes, get_reply):
+    '''Answers the framed requests of an upgraded connection until the client disconnects.
+
+    data is the message holding the "PROTO" line, get_reply maps a text query to its encoded reply.
+    '''
+    version, rest = parse_upgrade(data)
+    if version != VERSION:
+        connection.sendall(f'400 unsupported protocol version, expected {VERSION}\n'.encode())
+        return
+
+    connection.sendall(f'200 PROTO {VERSION}\n'.encode())
+    reader = FrameReader(connection, rest)
+    while True:
+        try:
+            frame = reader.read_frame(MAX_PAYLOAD)
+        except FramingError as e:   # the stream can not be resynchronised, report and hang up
+            connection.sendall(encode_frame(ERROR | RESPONSE, 0, str(e).encode()))
+            return
+        if frame is None:
+            return
+
+        opcode, _, request_id, payload = frame
+        connection.sendall(answer_frame(opcode, request_id, payload, get_reply))
+
+async def serve_framed_async(reader, writer, data: bytes, get_reply):
+    '''Same as serve_framed for asyncio streams, get_reply is a coroutine function'''
+    version, rest = parse_upgrade(data)
+    if version != VERSION:
+        writer.write(f'400 unsupported protocol version, expected {VERSION}\n'.encode())
+        await writer.drain()
+        return
+
+    writer.write(f'200 PROTO {VERSION}\n'.encode())
+    buffer = bytearray(rest)
+
+    async def read_exactly(size: int) -> bytes | None:
+        while len(buffer) < size:
+            data = await reader.read(65536)
+            if not data:
+                return None
+            buffer.extend(data)
+        chunk = bytes(buffer[:size])
+        del buffer[:size]
+        return chunk
+
+    while True:
+        header = await read_exactly(HEADER.size)
+        if header is None:
+            return
+        try:
+            opcode, _, request_id, length = decode_header(header)
+            if length > MAX_PAYLOAD:
+                raise FramingError(f'Frame of {length} bytes is too large')
+        except FramingError as e:
+            writer.write(encode_frame(ERROR | RESPONSE, 0, str(e).encode()))
+            await writer.drain()
+            return
+        payload = await read_exactly(length)
+        if payload is None:
+            return
+
+        try:
+            reply = encode_frame(opcode | RESPONSE, request_id, await get_reply(request_query(opcode, payload)))
+        except QueryError as e:     # answered like a malformed text query
+            reply = encode_frame(opcode | RESPONSE, request_id, encode_error(str(e)))
+        except (FramingError, UnicodeDecodeError) as e:
+            reply = encode_frame(ERROR | RESPONSE, request_id, str(e).encode())
+        writer.write(reply)
+        await writer.drain()
+
+class FramedClient():
+    '''Minimal blocking client of the framed protocol, sending requests ahead of reading their replies'''
+    def __init__(self, host: str='localhost', port: int=50007, timeout: float | None=None):
+        self.host = host
+        self.port = port
+        self.timeout = timeout
+        self.sock: socket.socket | None = None
+        self.reader: FrameReader | None = None
+        self.ids = itertools.count(1)
+
+    def connect(self):
+        '''Connects, waits for the "200 OK" handshake and upgrades the connection to framing'''
+        sock = socket.create_connection((self.host, self.port), timeout=self.timeout)
+        reader = FrameReader(sock)
+        handshake = reader.read_exactly(6)
+        if handshake != b'200 OK':
+            sock.close()
+            retry_after = parse_busy((handshake or b'') + bytes(reader.buffer))
+            if retry_after is not None:
+                raise ServerBusy(retry_after)
+            raise FramingError('Server did not complete the handshake')
+
+        sock.sendall(PROTO_PREFIX + f'{VERSION}\n'.encode())
+        line = b''
+        while not line.endswith(b'\n'):
+            chunk = reader.read_exactly(1)
+            if chunk is None:
+                break
+            line += chunk
+        if line != f'200 PROTO {VERSION}\n'.encode():
+            sock.close()
+            raise FramingError(f'Server refused framing: {line!r}')
+
+        self.sock, self.reader = sock, reader
+
+    def close(self):
+        '''Closes the connection'''
+        if self.sock is not None:
+            self.sock.close()
+            self.sock = self.reader = None
+
+    def send(self, pattern: str, opcode: int=QUERY) -> int:
+        '''Sends one request without waiting for its reply, returns its request ID'''
+        request_id = next(self.ids) & 0xFFFFFFFF
+        self.sock.sendall(encode_frame(opcode, request_id, pattern.encode()))
+        return request_id
+
+    def receive(self) -> tuple[int, int, bytes]:
+        '''Returns the opcode, request ID and payload of the next reply'''
+        frame = self.reader.read_frame()
+        if frame is None:
+            raise ConnectionError('Server closed the connection')
+        opcode, _, request_id, payload = frame
+        if opcode == ERROR | RESPONSE:
+            raise FramingError(payload.decode())
+        return opcode, request_id, payload
+
+    def batch(self, patterns: list[str]) -> list[bytes]:
+        '''Sends the patterns as one batch request, returns the reply of each pattern in order.
+
+        Raises QueryError when the server refuses the batch, such as one of no patterns or too many matches.
+        '''
+        self.send(' '.join(patterns), BATCH_QUERY)
+        reply = self.receive()[2]
+        if reply.startswith(b'400 '):   # one line, not a reply per pattern
+            raise QueryError(reply[len(b'400 '):].decode().strip())
+        return split_batch(reply)
+
+    def stats(self) -> dict:
+        '''Returns the server's metrics'''
+        self.send('', STATS_QUERY)
+        return json.loads(self.receive()[2].partition(b'\n')[2])
+
+    def pipeline(self, patterns: list[str], opcode: int=QUERY, window: int=32) -> list[bytes]:
+        '''Sends the patterns with up to window requests in flight, returns the replies in pattern order.
+
+        Bounding the requests in flight keeps both sides from blocking on full socket buffers.
+        '''
+        ids, replies = [], {}
+        for pattern in patterns:
+            if len(ids) - len(replies) >= window:
+                _, request_id, payload = self.receive()
+                replies[request_id] = payload
+            ids.append(self.send(pattern, opcode))
+        while len(replies) < len(ids):
+            _, request_id, payload = self.receive()
+            replies[request_id] = payload
+        return [replies[request_id] for request_id in ids]
@@ -0,0 +1,119 @@
+'''Per-query counters and latency histograms of a word server, read back with the STATS command'''
+import threading
+import time
+from bisect import bisect_left
+from collections import deque
+from protocol import COMMANDS, OPTIONS
+
+LATENCY_BOUNDS_MS = (0.1, 0.25, 0.5, 1, 2.5, 5, 10, 25, 50, 100, 250, 500, 1000, 2500)    # upper bounds of the histogram buckets, the last bucket is unbounded
+SLOW_QUERIES_KEPT = 100     # most recent slow queries reported by STATS
+
+def query_class(query: str) -> str:
+    '''Returns the class a query is counted under, from its text alone:
+
+    exact       a pattern without wildcards
+    wildcard    a pattern mixing letters and wildcards
+    only        a pattern of wildcards only (or empty), the broadest queries
+    page        a pattern with paging options
+    count, batch, stats, profile    the commands
+    '''
+    tokens = query.split()
+    if tokens and tokens[0] in COMMANDS:
+        return tokens[0].lower()
+    if len(tokens) > 1 and tokens[1].partition('=')[0] in OPTIONS:
+        return 'page'
+    pattern = tokens[0] if tokens else ''
+    if '?' not in pattern:
+        return 'exact' if pattern else 'only'
+    return 'only' if pattern.count('?') == len(pattern) else 'wildcard'
+
+class QueryStats():
+    '''Request count, errors, bytes and latency histogram of one class of queries'''
+    def __init__(self):
+        self.requests = 0
+        self.errors = 0     # "400" replies to malformed queries
+        self.bytes = 0      # reply bytes, compressed size for compressed replies
+        self.seconds = 0.0
+        self.max_seconds = 0.0
+        self.buckets = [0] * (len(LATENCY_BOUNDS_MS) + 1)
+
+    def summary(self) -> dict:
+        return {
+            'requests': self.requests,
+            'errors': self.errors,
+            'bytes': self.bytes,
+            'mean_ms': self.seconds / self.requests * 1000 if self.requests else 0.0,
+            'max_ms': self.max_seconds * 1000,
+            'histogram': {'le_ms': list(LATENCY_BOUNDS_MS) + ['inf'], 'counts': list(self.buckets)},
+        }
+
+class ServerMetrics():
+    '''Counts the queries a server answers and the connections it holds.
+
+    Recording a query costs one lock and a few additions, the histograms have fixed buckets so memory
+    does not grow with traffic. The latency of a reply is the time to build it; streamed replies are
+    built as they are sent, so theirs includes sending.
+
+    Queries taking at least slow_ms milliseconds are logged as they finish and the most recent ones are
+    kept for STATS, None logs none.
+    '''
+    def __init__(self, slow_ms: float | None=None):
+        self.started = time.time()
+        self.slow_ms = slow_ms
+        self.connections = 0    # connections accepted since start
+        self.active = 0         # connections open right now
+        self.classes: dict[str, QueryStats] = {}
+        self.slow_queries: deque[dict] = deque(maxlen=SLOW_QUERIES_KEPT)
+        self.lock = threading.Lock()
+
+    def opened(self):
+        '''Counts a new client connection'''
+        with self.lock:
+            self.connections += 1
+            self.active += 1
+
+    def closed(self):
+        '''Counts a client connection going away'''
+        with self.lock:
+            self.active -= 1
+
+    def record(self, query: str, seconds: float, size: int, error: bool=False):
+        '''Counts one answered query, how long it took and how many reply bytes it produced'''
+        bucket = bisect_left(LATENCY_BOUNDS_MS, seconds * 1000)
+        kind = query_class(query)
+        with self.lock:
+            stats = self.classes.get(kind)
+            if stats is None:
+                stats = self.classes[kind] = QueryStats()
+            stats.requests += 1
+            stats.errors += error
+            stats.bytes += size
+            stats.seconds += seconds
+            stats.max_seconds = max(stats.max_seconds, seconds)
+            stats.buckets[bucket] += 1
+        if self.slow_ms is not None and seconds * 1000 >= self.slow_ms:
+            self.logSlow(query, seconds, size)
+
+    def logSlow(self, query: str, seconds: float, size: int):
+        '''Logs a query slower than slow_ms'''
+        entry = {'time': time.time(), 'ms': round(seconds * 1000, 3), 'bytes': size, 'query': query.strip()[:200]}     # batches can be long
+        print(f"Slow query ({entry['ms']:.1f} ms, {size} bytes) at {time.ctime(entry['time'])}: {entry['query']!r}")
+        with self.lock:
+            self.slow_queries.append(entry)
+
+    def stats(self) -> dict:
+        '''Returns the connection counters, the totals and the statistics of every class of queries'''
+        with self.lock:
+            classes = {kind: stats.summary() for kind, stats in self.classes.items()}
+            connections = {'accepted': self.connections, 'active': self.active}
+            slow_queries = list(self.slow_queries)
+        return {
+            'uptime_s': time.time() - self.started,
+            'connections': connections,
+            'requests': sum(stats['requests'] for stats in classes.values()),
+            'errors': sum(stats['errors'] for stats in classes.values()),
+            'bytes_sent': sum(stats['bytes'] for stats in classes.values()),
+            'queries': classes,
+            'slow_ms': self.slow_ms,
+            'slow_queries': slow_queries,
+        }
@@ -0,0 +1,74 @@
+'''N-gram (q-gram) index that narrows ExtraServer substring queries down to a few candidate words'''
+import re
+from collections.abc import Iterator
+from array import array
+
+class NgramIndex():
+    '''Maps every 1..q character gram to the sorted IDs of the words containing it.
+
+    A query picks the rarest gram found in the literal runs of the pattern (a run shorter than q is a
+    gram itself), and only the words of that posting list are verified against the pattern. Patterns
+    without literals match every word at least as long as the pattern, so a length filter answers them.
+    '''
+    def __init__(self, words: list[str], q: int=3):
+        self.q = q
+        self.words = list(words)
+        self.postings: dict[str, array] = {}
+        self.at_least = [0] * (max((len(word) for word in self.words), default=0) + 2)     # number of words of at least each length
+
+        for word in self.words:
+            self.at_least[len(word)] += 1
+        for length in range(len(self.at_least) - 2, -1, -1):
+            self.at_least[length] += self.at_least[length + 1]
+
+        ids: dict[str, list[int]] = {}
+        for word_id, word in enumerate(self.words):
+            grams = {word[start:start + n] for n in range(1, q + 1) for start in range(len(word) - n + 1)}
+            for gram in grams:
+                ids.setdefault(gram, []).append(word_id)
+        self.postings = {gram: array('I', gram_ids) for gram, gram_ids in ids.items()}   # compact unsigned int arrays
+
+    def grams(self, target: str) -> list[str]:
+        '''Returns the grams every word matching the target pattern must contain'''
+        grams = []
+        for run in target.split('?'):   # literal runs between wildcards
+            if len(run) <= self.q:
+                if run:
+                    grams.append(run)
+            else:
+                grams.extend(run[start:start + self.q] for start in range(len(run) - self.q + 1))
+        return grams
+
+    def iter_match_ids(self, target: str, grams: list[str]) -> Iterator[int]:
+        '''Yields the IDs of the words matching a target pattern that contains at least one gram'''
+        if grams == [target]:   # a short pattern without wildcards is a gram, its postings are the exact answer
+            yield from self.postings.get(target, ())
+            return
+
+        candidates = min((self.postings.get(gram, ()) for gram in grams), key=len)   # rarest gram gives the fewest candidates
+        search = re.compile(''.join('.' if c == '?' else re.escape(c) for c in target)).search
+        yield from (word_id for word_id in candidates if search(self.words[word_id]))
+
+    def find(self, target: str) -> tuple[list[str], int]:
+        '''Return all words matching the target pattern and the number of matches'''
+        grams = self.grams(target)
+        if not grams:   # only wildcards: any word at least as long as the pattern contains a match
+            word_list = [word for word in self.words if len(word) >= len(target)]
+        else:
+            word_list = [self.words[word_id] for word_id in self.iter_match_ids(target, grams)]
+        return word_list, len(word_list)
+
+    def iter_matches(self, target: str) -> Iterator[str]:
+        '''Yields the words matching the target pattern one at a time'''
+        grams = self.grams(target)
+        if not grams:
+            yield from (word for word in self.words if len(word) >= len(target))
+        else:
+            yield from (self.words[word_id] for word_id in self.iter_match_ids(target, grams))
+
+    def count(self, target: str) -> int:
+        '''Return the number of words matching the target pattern without building the words'''
+        grams = self.grams(target)
+        if not grams:
+            return self.at_least[min(len(target), len(self.at_least) - 1)]
+        return sum(1 for _ in self.iter_match_ids(target, grams))
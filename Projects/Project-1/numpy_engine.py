@@ -0,0 +1,55 @@
+'''NumPy matching engine over a fixed-width uint8 word matrix'''
+from collections.abc import Iterator
+import numpy as np
+from numpy.lib.stride_tricks import sliding_window_view
+
+class NumpyEngine():
+    '''Packs the dictionary into an N x (longest word) uint8 matrix plus a length vector.
+
+    Whole-word matching is one length comparison and one column comparison per literal of the pattern.
+    Substring matching compares the same literals across strided sliding-window views of every offset.
+    '''
+    def __init__(self, words: list[str], substring: bool=False):
+        self.substring = substring
+        self.words = list(words)
+        self.width = max((len(word) for word in self.words), default=0)
+        self.lengths = np.array([len(word) for word in self.words], dtype=np.int64)
+
+        blob = np.frombuffer(''.join(word.ljust(self.width, '\0') for word in self.words).encode('latin-1'), dtype=np.uint8)
+        self.matrix = blob.reshape(len(self.words), self.width)     # zero-padded rows, one per word
+
+    def match(self, target: str) -> np.ndarray:
+        '''Returns a boolean mask of the words that match the target pattern'''
+        if len(target) > self.width or any(ord(c) > 255 for c in target):   # can not appear in any word
+            return np.zeros(len(self.words), dtype=bool)
+
+        literals = [(i, ord(c)) for i, c in enumerate(target) if c != '?']
+        if not self.substring:
+            mask = self.lengths == len(target)
+            for i, code in literals:
+                mask &= self.matrix[:, i] == code
+            return mask
+
+        if not target:  # the empty pattern is inside every word
+            return np.ones(len(self.words), dtype=bool)
+
+        windows = sliding_window_view(self.matrix, len(target), axis=1)     # N x offsets x len(target), no copy
+        offsets = np.arange(windows.shape[1])
+        hits = self.lengths[:, None] >= offsets + len(target)   # the window must lie inside the word
+        for i, code in literals:
+            hits &= windows[:, :, i] == code
+        return hits.any(axis=1)
+
+    def find(self, target: str) -> tuple[list[str], int]:
+        '''Return all words matching the target pattern and the number of matches'''
+        word_list = [self.words[i] for i in np.flatnonzero(self.match(target)).tolist()]
+        return word_list, len(word_list)
+
+    def iter_matches(self, target: str) -> Iterator[str]:
+        '''Yields the words matching the target pattern one at a time'''
+        for i in np.flatnonzero(self.match(target)).tolist():
+            yield self.words[i]
+
+    def count(self, target: str) -> int:
+        '''Return the number of words matching the target pattern without building the words'''
+        return int(np.count_nonzero(self.match(target)))
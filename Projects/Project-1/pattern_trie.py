@@ -0,0 +1,57 @@
+'''Trie of wildcard patterns, matching a word against a whole batch of patterns in one walk'''
+from collections.abc import Iterable
+
+class PatternTrie():
+    '''Patterns sharing a prefix share the trie nodes of that prefix, '?' is an ordinary edge.
+
+    Walking a word follows both the edge of its character and the '?' edge from every live node, so
+    the work per character grows with the number of distinct prefixes alive at that point rather than
+    with the number of patterns.
+    '''
+    def __init__(self, patterns: Iterable[str]):
+        self.children: list[dict[str, int]] = [{}]
+        self.ends: list[list[str]] = [[]]   # patterns ending at each node
+        for pattern in dict.fromkeys(patterns):
+            node = 0
+            for c in pattern:
+                child = self.children[node].get(c)
+                if child is None:
+                    child = len(self.children)
+                    self.children[node][c] = child
+                    self.children.append({})
+                    self.ends.append([])
+                node = child
+            self.ends[node].append(pattern)
+
+    def step(self, nodes: list[int], c: str) -> list[int]:
+        '''Returns the nodes reached from nodes by the character c'''
+        reached = []
+        for node in nodes:
+            children = self.children[node]
+            if c in children:
+                reached.append(children[c])
+            if '?' in children and c != '?':
+                reached.append(children['?'])
+        return reached
+
+    def match(self, word: str) -> list[str]:
+        '''Returns the patterns matching the whole word'''
+        nodes = [0]
+        for c in word:
+            nodes = self.step(nodes, c)
+            if not nodes:
+                return []
+        return [pattern for node in nodes for pattern in self.ends[node]]
+
+    def search(self, word: str) -> set[str]:
+        '''Returns the patterns matching anywhere inside the word'''
+        found = set(self.ends[0])   # the empty pattern is inside every word
+        for start in range(len(word)):
+            nodes = [0]
+            for c in word[start:]:
+                nodes = self.step(nodes, c)
+                if not nodes:
+                    break
+                for node in nodes:
+                    found.update(self.ends[node])
+        return found
@@ -0,0 +1,89 @@
+'''Positional (index, char) inverted index for exact-length "?" wildcard patterns'''
+from collections.abc import Iterator
+
+# bit positions set in every possible byte value, used to turn a bitset back into word IDs
+BYTE_BITS = tuple(tuple(bit for bit in range(8) if value >> bit & 1) for value in range(256))
+
+def to_bitset(ids: list[int], size: int) -> int:
+    '''Packs a list of word IDs into an int whose set bits are those IDs'''
+    bits = bytearray((size + 7) // 8)
+    for i in ids:
+        bits[i >> 3] |= 1 << (i & 7)
+    return int.from_bytes(bits, 'little')
+
+def from_bitset(bitset: int, size: int) -> list[int]:
+    '''Returns the IDs of the set bits of a bitset in ascending order'''
+    return list(iter_bitset(bitset, size))
+
+def iter_bitset(bitset: int, size: int) -> Iterator[int]:
+    '''Yields the IDs of the set bits of a bitset in ascending order'''
+    for byte_index, byte in enumerate(bitset.to_bytes((size + 7) // 8, 'little')):
+        if byte:    # skip the (usually many) empty bytes without looking at single bits
+            base = byte_index << 3
+            for bit in BYTE_BITS[byte]:
+                yield base + bit
+
+class PositionalIndex():
+    '''Posting index keyed by (position, character) over word IDs, partitioned by word length.
+
+    Every word of length L gets an ID local to the length-L bucket, and every (position, character)
+    pair of that bucket maps to a bitset of the IDs having that character at that position. A query
+    intersects one bitset per literal of the pattern, so its cost follows the bucket size / 64 and
+    the number of matches instead of the size of the whole dictionary.
+    '''
+    def __init__(self, words: list[str], postings: dict[int, dict[tuple[int, str], int]] | None=None):
+        self.buckets: dict[int, list[str]] = {}                     # words of each length, in word list order
+        self.postings: dict[int, dict[tuple[int, str], int]] = {}   # length -> (position, char) -> bitset
+
+        for word in words:
+            self.buckets.setdefault(len(word), []).append(word)
+
+        if postings is not None:    # bitsets loaded from the word index file, nothing to build
+            self.postings = postings
+            return
+
+        for length, bucket in self.buckets.items():
+            ids: dict[tuple[int, str], list[int]] = {}
+            for word_id, word in enumerate(bucket):
+                for position, char in enumerate(word):
+                    ids.setdefault((position, char), []).append(word_id)
+            self.postings[length] = {key: to_bitset(key_ids, len(bucket)) for key, key_ids in ids.items()}
+
+    def match(self, target: str) -> int:
+        '''Returns the bitset of the words in the target's length bucket that match the target pattern'''
+        bucket = self.buckets.get(len(target))
+        if not bucket:
+            return 0
+
+        postings = self.postings.get(len(target), {})
+        bitset = (1 << len(bucket)) - 1     # start with every word of the right length
+        for position, char in enumerate(target):
+            if char == '?':     # wildcards do not narrow down the candidates
+                continue
+            bitset &= postings.get((position, char), 0)
+            if not bitset:      # no word left, remaining literals can not bring any back
+                break
+
+        return bitset
+
+    def find(self, target: str) -> tuple[list[str], int]:
+        '''Return all words matching the target pattern and the number of matches'''
+        bitset = self.match(target)
+        if not bitset:
+            return [], 0
+
+        bucket = self.buckets[len(target)]
+        word_list = [bucket[word_id] for word_id in from_bitset(bitset, len(bucket))]
+        return word_list, len(word_list)
+
+    def iter_matches(self, target: str) -> Iterator[str]:
+        '''Yields the words matching the target pattern one at a time'''
+        bitset = self.match(target)
+        if bitset:
+            bucket = self.buckets[len(target)]
+            for word_id in iter_bitset(bitset, len(bucket)):
+                yield bucket[word_id]
+
+    def count(self, target: str) -> int:
+        '''Return the number of words matching the target pattern without building the words'''
+        return self.match(target).bit_count()
@@ -0,0 +1,153 @@
+'''On-demand profiling of a live word server, switched on and off with the PROFILE command
+
+    PROFILE cpu requests=200        cProfile the next 200 queries
+    PROFILE memory seconds=30       tracemalloc snapshot of the allocations of the next 30 seconds
+    PROFILE stop                    end the running session early
+
+A session ends after the given number of queries or seconds, whichever comes first, and writes its
+results to a new file in the server's profile directory: a pstats file for cpu (python -m pstats <file>)
+and a tracemalloc snapshot for memory (tracemalloc.Snapshot.load). The file name is chosen by the
+server, clients never name files.
+'''
+import cProfile
+import math
+import os
+import threading
+import time
+import tracemalloc
+from collections.abc import Iterator
+from protocol import QueryError, encode_profile
+
+CPU = 'cpu'
+MEMORY = 'memory'
+KINDS = (CPU, MEMORY)
+STOP = 'stop'
+DEFAULT_REQUESTS = 100  # length of a session given neither requests nor seconds
+MAX_SECONDS = 3600      # longest session, a forgotten cpu session serializes every query
+
+class Profiler():
+    '''Profiles the queries of one server while a session runs, costing one attribute check otherwise.
+
+    cProfile follows a single thread, so while a cpu session runs the profiled queries take turns:
+    the server answers one query at a time until the session ends. tracemalloc traces every thread
+    and does not serialize the queries. Queries answered in worker processes are not profiled.
+    '''
+    def __init__(self, directory: str, name: str='server'):
+        self.directory = directory  # where session files are written
+        self.name = name            # prefix of the file names
+        self.kind: str | None = None    # kind of the running session, None when profiling is off
+        self.remaining: int | None = None   # queries left in the session
+        self.path: str | None = None
+        self.profile: cProfile.Profile | None = None
+        self.timer: threading.Timer | None = None
+        self.lock = threading.Lock()
+
+    def command(self, action: str, options: dict[str, str]) -> bytes:
+        '''Answers a "PROFILE <action> [requests=N] [seconds=T]" query'''
+        if action == STOP:
+            with self.lock:
+                path = self.finish()
+            return encode_profile('stopped' if path else 'not running', path)
+        if action not in KINDS:
+            raise QueryError(f'unknown profile {action!r}, expected one of {", ".join(KINDS + (STOP,))}')
+
+        try:
+            requests = int(options['requests']) if 'requests' in options else None
+            seconds = float(options['seconds']) if 'seconds' in options else None
+        except ValueError:
+            raise QueryError('requests and seconds must be numbers')
+        if requests is not None and requests <= 0:
+            raise QueryError('requests must be positive')
+        if seconds is not None and not (math.isfinite(seconds) and 0 < seconds <= MAX_SECONDS):  # inf overflows the timer, nan compares false
+            raise QueryError(f'seconds must be more than 0 and at most {MAX_SECONDS}')
+        if requests is None and seconds is None:
+            requests = DEFAULT_REQUESTS
+
+        path = self.start(action, requests, seconds)
+        limits = ' or '.join(f'{value:g} {unit}' for value, unit in ((requests, 'requests'), (seconds, 'seconds')) if value is not None)
+        return encode_profile(f'{action} started for {limits}', path)
+
+    def start(self, kind: str, requests: int | None=None, seconds: float | None=None) -> str:
+        '''Starts a session of the next requests queries or seconds, returns the file it will write'''
+        with self.lock:
+            if self.kind is not None:
+                raise QueryError(f'a {self.kind} profile is already running')
+            os.makedirs(self.directory, exist_ok=True)
+            suffix = 'prof' if kind == CPU else 'snapshot'
+            self.path = os.path.join(self.directory, f'{self.name}-{kind}-{time.strftime("%Y%m%d-%H%M%S")}-{os.getpid()}.{suffix}')
+            if kind == CPU:
+                self.profile = cProfile.Profile()
+            else:
+                tracemalloc.start(25)   # frames kept per allocation, enough to reach the server's methods
+            self.remaining = requests
+            if seconds is not None:
+                self.timer = threading.Timer(seconds, self.stop)
+                self.timer.daemon = True
+                self.timer.start()
+            self.kind = kind
+            print(f'Started {kind} profile, writing {self.path}')
+            return self.path
+
+    def stop(self) -> str | None:
+        '''Ends the running session, returns the file written or None when no session was running'''
+        with self.lock:
+            return self.finish()
+
+    def finish(self) -> str | None:
+        '''Ends the running session with the lock held, writing its file'''
+        if self.kind is None:
+            return None
+        if self.timer is not None:
+            self.timer.cancel()
+        if self.kind == CPU:
+            self.profile.dump_stats(self.path)
+        else:
+            tracemalloc.take_snapshot().dump(self.path)
+            tracemalloc.stop()
+        print(f'Wrote {self.kind} profile to {self.path}')
+        path = self.path
+        self.kind = self.remaining = self.path = self.profile = self.timer = None
+        return path
+
+    def call(self, run, *args, request: bool=True):
+        '''Returns run(*args), profiled if a session is running.
+
+        request counts the call toward the session's queries, see iterate for streamed replies.
+        '''
+        if self.kind == CPU:
+            with self.lock:
+                if self.profile is not None:    # the session may have ended while waiting for the lock
+                    self.profile.enable()
+                    try:
+                        return run(*args)
+                    finally:
+                        self.profile.disable()
+                        if request:
+                            self.decrement()
+        result = run(*args)
+        if request:
+            self.count()
+        return result
+
+    def iterate(self, chunks: Iterator[bytes]) -> Iterator[bytes]:
+        '''Yields the chunks of a streamed reply, profiling the production of each one and counting one query.
+
+        The sending between chunks is not profiled, so a slow client does not hold up a cpu session.
+        '''
+        try:
+            while (chunk := self.call(next, chunks, None, request=False)) is not None:
+                yield chunk
+        finally:    # also counted when the client went away mid-reply
+            self.count()
+
+    def count(self):
+        '''Counts one profiled query, ending the session once it had its queries'''
+        with self.lock:
+            self.decrement()
+
+    def decrement(self):
+        '''Same as count with the lock held'''
+        if self.remaining is not None:
+            self.remaining -= 1
+            if self.remaining <= 0:
+                self.finish()
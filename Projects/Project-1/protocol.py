@@ -0,0 +1,301 @@
+'''Query and reply formats shared by the word servers'''
+import base64
+import binascii
+import json
+import struct
+import time
+import zlib
+from collections.abc import Iterable, Iterator
+from itertools import chain, islice
+
+COUNT = 'COUNT'     # "COUNT <pattern>" replies with the number of matches only
+BATCH = 'BATCH'     # "BATCH <pattern> <pattern> ..." replies with the full reply of each pattern, in order
+STATS = 'STATS'     # "STATS" replies with the server's metrics as one line of JSON
+PROFILE = 'PROFILE'     # "PROFILE cpu|memory|stop [requests=N] [seconds=T]" profiles the next queries, see profiling.py
+COMMANDS = (COUNT, BATCH, STATS, PROFILE)
+MAX_BATCH = 256     # most patterns of one batch
+MAX_BATCH_MATCHES = 100_000     # most words of one batch reply, which is built whole; broad patterns are streamed on their own
+MAX_BATCH_BYTES = 4 * 1024 * 1024   # most bytes of words of one batch reply
+OPTIONS = ('limit', 'offset', 'cursor')     # "<pattern> limit=50 offset=100" or "<pattern> limit=50 cursor=..."
+PROFILE_OPTIONS = ('requests', 'seconds')   # options of the PROFILE command instead of the paging ones
+CURSOR = struct.Struct('!I4s4s')    # offset of the next match, pattern checksum, word list version
+
+class QueryError(ValueError):
+    '''Raised for a malformed query, the client gets a "400 <reason>" reply'''
+
+CHUNK_SIZE = 64 * 1024      # most bytes of a streamed reply held in memory at once
+STREAM_THRESHOLD = 2000     # replies with more matches are streamed instead of built and cached
+
+COMPRESS_PREFIX = b'COMPRESS '  # "COMPRESS zlib" after the handshake turns compression on for the connection
+COMPRESSION = 'zlib'
+COMPRESSED = b'Z\n'     # starts a compressed reply, followed by one complete zlib stream
+COMPRESS_THRESHOLD = 16 * 1024  # smaller replies are always sent as they are
+COMPRESS_LEVEL = 1      # fastest level, replies still shrink about 2.7 times
+
+def normalize_pattern(query: str) -> str:
+    '''Returns the pattern of a client query.
+
+    Words never contain whitespace, so whitespace around a query (such as the newline sent by
+    line-based clients) is not part of the pattern.
+    '''
+    return query.strip()
+
+def parse_query(query: str) -> tuple[str | None, str, dict[str, str]]:
+    '''Splits a client query into its command, its pattern and its "key=value" options.
+
+    Plain pattern queries have no command. Commands are upper case and patterns are matched against
+    lower case words without whitespace, so neither a leading command name nor the options that
+    follow the pattern are ever part of it.
+    '''
+    tokens = normalize_pattern(query).split()
+    command = tokens.pop(0) if tokens and tokens[0] in COMMANDS else None
+    if command == BATCH:    # every token is a pattern, kept as one space separated string
+        if not tokens:  # the reply would be empty and a text client would wait for it forever
+            raise QueryError('batch of no patterns')
+        if len(tokens) > MAX_BATCH:
+            raise QueryError(f'batch of {len(tokens)} patterns, at most {MAX_BATCH} are allowed')
+        return command, ' '.join(tokens), {}
+    pattern = tokens[0] if tokens else ''
+
+    allowed = PROFILE_OPTIONS if command == PROFILE else OPTIONS if command is None else ()
+    options = {}
+    for token in tokens[1:]:
+        key, separator, value = token.partition('=')
+        if not allowed:     # a COUNT is never paged, it would silently reply with words instead
+            raise QueryError(f'{command} takes no options, got {token!r}')
+        if not separator or key not in allowed:
+            raise QueryError(f'unknown option {token!r}, expected one of {", ".join(allowed)}')
+        options[key] = value
+    return command, pattern, options
+
+def encode_error(reason: str) -> bytes:
+    '''Formats the reply to a malformed query'''
+    return f'400 {reason}\n'.encode()
+
+def encode_busy(retry_after: float) -> bytes:
+    '''Formats the answer to a client the server is too busy to take on, instead of the "200 OK" handshake'''
+    return f'503 BUSY retry-after={retry_after:g}\n'.encode()
+
+def parse_busy(answer: bytes) -> float | None:
+    '''Returns the retry-after seconds of a "503 BUSY" answer, None for any other answer'''
+    if not answer.startswith(b'503'):
+        return None
+    _, _, value = answer.partition(b'retry-after=')
+    try:
+        return float(value.strip() or 0)
+    except ValueError:
+        return 0.0
+
+def encode_reply(words: list[str], matches: int) -> bytes:
+    '''Formats the matching words the way the clients print them, ending with a newline'''
+    reply = f" (Total matches: {matches})\n"
+    if matches > 0:
+        reply += ', '.join(words)
+    reply += '\n'
+    return reply.encode()
+
+def encode_count(matches: int) -> bytes:
+    '''Formats the reply to a COUNT query, the header line of a full reply'''
+    return f" (Total matches: {matches})\n".encode()
+
+def decode_count(reply: bytes) -> int:
+    '''Returns the number of matches in the header line of a reply, raising QueryError for a "400" reply'''
+    header = reply.split(b'\n', 1)[0].decode()
+    if header.startswith('400 '):
+        raise QueryError(header[len('400 '):])
+    if not header.startswith(' (Total matches: '):
+        raise ValueError(f'unexpected reply {header!r}')
+    return int(header[len(' (Total matches: '):-1])
+
+def decode_reply(reply: bytes) -> tuple[list[str], int]:
+    '''Returns the words and the number of matches of a reply made by encode_reply'''
+    matches = decode_count(reply)
+    words = reply.split(b'\n', 1)[1].rstrip(b'\n').decode()
+    return (words.split(', ') if matches else []), matches
+
+def encode_batch(results: Iterable[tuple[list[str], int]]) -> bytes:
+    '''Formats the reply to a BATCH query, the full reply of each pattern one after the other'''
+    return b''.join(encode_reply(words, matches) for words, matches in results)
+
+def encode_stats(stats: dict) -> bytes:
+    '''Formats the reply to a STATS query, a status line then the metrics as one line of JSON'''
+    return b'200 STATS\n' + json.dumps(stats, separators=(',', ':')).encode() + b'\n'
+
+def encode_profile(status: str, path: str | None) -> bytes:
+    '''Formats the reply to a PROFILE query, a status line then the file the session writes ("none" if there is none)'''
+    return f'200 PROFILE {status}\n{path or "none"}\n'.encode()
+
+def split_batch(reply: bytes) -> list[bytes]:
+    '''Splits the reply to a BATCH query into the reply of each pattern, every reply is exactly two lines'''
+    lines = reply.splitlines(keepends=True)
+    return [lines[i] + lines[i + 1] for i in range(0, len(lines), 2)]
+
+def negotiate_compression(data: bytes) -> tuple[bool, bytes]:
+    '''Answers a client's "COMPRESS <algorithm>" request, returns whether compression is on and the answer'''
+    algorithm = data[len(COMPRESS_PREFIX):].strip().decode(errors='replace')
+    if algorithm == COMPRESSION:
+        return True, f'200 COMPRESS {COMPRESSION}\n'.encode()
+    return False, f'400 unsupported compression {algorithm!r}, expected {COMPRESSION}\n'.encode()
+
+def compress_reply(reply: bytes, threshold: int=COMPRESS_THRESHOLD) -> bytes:
+    '''Returns the reply compressed when it is at least threshold bytes, otherwise the reply itself.
+
+    Plain replies never start with COMPRESSED, so both forms can be told apart (and cached) as they are.
+    '''
+    if len(reply) < threshold:
+        return reply
+    return COMPRESSED + zlib.compress(reply, COMPRESS_LEVEL)
+
+def decompress_reply(reply: bytes) -> bytes:
+    '''Returns the plain form of a reply made by compress_reply'''
+    if not reply.startswith(COMPRESSED):
+        return reply
+    return zlib.decompress(memoryview(reply)[len(COMPRESSED):])
+
+def compress_stream(chunks: Iterable[bytes]) -> Iterator[bytes]:
+    '''Yields the compressed form of a reply sent in chunks, one zlib stream compressed as it goes'''
+    yield COMPRESSED
+    compressor = zlib.compressobj(COMPRESS_LEVEL)
+    for chunk in chunks:
+        if packed := compressor.compress(chunk):
+            yield packed
+    yield compressor.flush()
+
+def stream_reply(words: Iterable[str], matches: int, chunk_size: int=CHUNK_SIZE) -> Iterator[bytes]:
+    '''Yields the same bytes as encode_reply in chunks of about chunk_size bytes, consuming words lazily'''
+    yield f" (Total matches: {matches})\n".encode()
+    chunk, size, prefix = [], 0, ''     # chunk only references the words, the separators are added by join
+    for word in words:
+        chunk.append(word)
+        size += len(word) + 2
+        if size >= chunk_size:
+            yield (prefix + ', '.join(chunk)).encode()
+            chunk, size, prefix = [], 0, ', '
+    yield (prefix + ', '.join(chunk) + '\n').encode() if chunk else b'\n'
+
+def cache_stream(chunks: Iterable[bytes], cache, mode: str, pattern: str, compressed: bool=False) -> Iterator[bytes]:
+    '''Yields the chunks of a streamed reply, then caches the whole reply once every chunk was sent.
+
+    The reply is cached compressed: compressed tells whether the chunks already are, otherwise they
+    are compressed as they pass. The compressed bytes are only kept while they fit the cache's budget,
+    so a reply too large to be cached is never held in memory. Nothing is cached when the client went
+    away mid-reply.
+    '''
+    compressor = None if compressed else zlib.compressobj(COMPRESS_LEVEL)
+    kept, size = ([] if compressed else [COMPRESSED]), 0
+    for chunk in chunks:
+        yield chunk
+        if kept is not None:
+            packed = chunk if compressor is None else compressor.compress(chunk)
+            kept.append(packed)
+            size += len(packed)
+            if size > cache.max_bytes:  # the cache would not store it, stop keeping it
+                kept = None
+    if kept is not None:
+        if compressor is not None:
+            kept.append(compressor.flush())
+        cache.put(mode, pattern, b''.join(kept))
+
+def iter_reply(server, query: str, chunk_size: int=CHUNK_SIZE, threshold: int | None=STREAM_THRESHOLD, compress: bool=False) -> Iterator[bytes]:
+    '''Yields the reply of a word server to a query, streaming pattern queries with many matches.
+
+    Cached replies, commands and paged queries come from server.getReply in one piece. Other patterns
+    are matched in one pass of server.iterQuery: when it yields at most threshold words the reply is
+    built from them, otherwise the matches are counted for the reply header and the pass goes on with
+    the words sent in bounded chunks, so neither the word list nor the reply is built. Replies are
+    cached as getReply would, streamed ones once they are sent. A threshold of None never streams.
+    compress sends large replies compressed, for clients that negotiated it. These replies are
+    counted in server.metrics and profiled by server.profiler here, getReply handles the others.
+    '''
+    try:
+        command, pattern, options = parse_query(query)
+    except QueryError:  # getReply answers with the error
+        yield server.getReply(query, compress)
+        return
+    view = server.view  # counted, streamed and cached from the same word list
+    if command is None and not options and threshold is not None and (server.cache is None or not server.cache.contains(view.cache_mode, pattern)):
+        start = time.perf_counter()
+        profiler = server.profiler if server.profiler.kind is not None else None    # a PROFILE session is running
+        words = server.iterQuery(pattern, view)
+        head = list(islice(words, threshold + 1)) if profiler is None else profiler.call(list, islice(words, threshold + 1), request=False)
+        if len(head) <= threshold:  # every match is in head, no second pass
+            reply = encode_reply(head, len(head))
+            if compress or server.cache is not None:
+                packed = compress_reply(reply)
+                if server.cache is not None:
+                    server.cache.put(view.cache_mode, pattern, packed)
+                reply = packed if compress else reply
+            if profiler is not None:
+                profiler.count()
+            server.metrics.record(query, time.perf_counter() - start, len(reply))
+            yield reply
+            return
+
+        matches = server.countQuery(pattern, view) if profiler is None else profiler.call(server.countQuery, pattern, view, request=False)
+        chunks = stream_reply(chain(head, words), matches, chunk_size)
+        if compress:
+            chunks = compress_stream(chunks)
+        if profiler is not None:
+            chunks = profiler.iterate(chunks)
+        if server.cache is not None:
+            chunks = cache_stream(chunks, server.cache, view.cache_mode, pattern, compress)
+        size = 0
+        try:
+            for chunk in chunks:
+                size += len(chunk)
+                yield chunk
+        finally:    # also counted when the client went away mid-reply
+            server.metrics.record(query, time.perf_counter() - start, size)
+        return
+
+    yield server.getReply(query, compress)
+
+def encode_cursor(pattern: str, offset: int, version: bytes) -> str:
+    '''Returns the opaque cursor resuming the pattern's matches at offset'''
+    token = CURSOR.pack(offset, zlib.crc32(pattern.encode()).to_bytes(4, 'big'), version[:4].ljust(4, b'\0'))
+    return base64.urlsafe_b64encode(token).decode().rstrip('=')
+
+def decode_cursor(cursor: str, pattern: str, version: bytes) -> int:
+    '''Returns the offset a cursor resumes at, checking it was issued for this pattern and word list'''
+    try:
+        offset, checksum, cursor_version = CURSOR.unpack(base64.urlsafe_b64decode(cursor + '=' * (-len(cursor) % 4)))
+    except (binascii.Error, ValueError, struct.error):
+        raise QueryError('invalid cursor')
+    if checksum != zlib.crc32(pattern.encode()).to_bytes(4, 'big'):
+        raise QueryError('cursor was issued for another pattern')
+    if cursor_version != version[:4].ljust(4, b'\0'):
+        raise QueryError('cursor was issued for another word list')
+    return offset
+
+def parse_count(options: dict[str, str], key: str) -> int | None:
+    '''Returns a non-negative integer option, None when it is not given'''
+    if key not in options:
+        return None
+    if not options[key].isdecimal() or not options[key].isascii():    # isdigit also accepts '²', which int rejects
+        raise QueryError(f'{key} must be a non-negative integer')
+    return int(options[key])
+
+def encode_page(words: list[str], cursor: str | None) -> bytes:
+    '''Formats one page of matches and the cursor of the next page ("none" after the last page)'''
+    return f" (Page matches: {len(words)}, next cursor: {cursor or 'none'})\n{', '.join(words)}\n".encode()
+
+def page_reply(server, pattern: str, options: dict[str, str]) -> bytes:
+    '''Returns one page of a word server's matches, scanning no further than the end of the page.
+
+    The page starts at the offset given by the cursor or offset option and holds at most limit words.
+    Matches before the offset are skipped without being collected.
+    '''
+    view = server.view  # the cursor's version and the page come from the same word list
+    version = view.store.version
+    limit = parse_count(options, 'limit')
+    if limit == 0:  # an empty page would hand back a cursor to itself
+        raise QueryError('limit must be at least 1')
+    offset = parse_count(options, 'offset') or 0
+    if 'cursor' in options:
+        offset = decode_cursor(options['cursor'], pattern, version)
+
+    stop = None if limit is None else offset + limit + 1     # one more match tells whether a next page exists
+    words = list(islice(server.iterQuery(pattern, view), offset, stop))
+    if limit is None or len(words) <= limit:
+        return encode_page(words, None)
+    return encode_page(words[:limit], encode_cursor(pattern, offset + limit, version))
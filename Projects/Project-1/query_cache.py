@@ -0,0 +1,77 @@
+'''Bounded, thread-safe LRU cache of encoded query replies shared by the word servers'''
+import threading
+from collections import OrderedDict
+
+class QueryCache():
+    '''Maps (server mode, normalized pattern) to the encoded reply bytes, so a hit costs one sendall.
+
+    The mode names the word list as well as the matching (see serving.use_store), so replies of a word
+    list are only ever served from it and a reload has nothing to invalidate.
+
+    The cache is bounded by the total size of the stored replies in bytes, evicting the least recently
+    used entries first. Replies larger than the whole budget are never stored.
+    '''
+    def __init__(self, max_bytes: int=32 * 1024 * 1024):
+        self.max_bytes = max_bytes
+        self.size = 0           # bytes of all stored replies
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.entries: OrderedDict[tuple[str, str], bytes] = OrderedDict()
+        self.lock = threading.Lock()
+
+    def get(self, mode: str, pattern: str) -> bytes | None:
+        '''Returns the cached reply for the pattern, or None on a miss'''
+        with self.lock:
+            reply = self.entries.get((mode, pattern))
+            if reply is None:
+                self.misses += 1
+                return None
+
+            self.entries.move_to_end((mode, pattern))   # most recently used entries live at the end
+            self.hits += 1
+            return reply
+
+    def contains(self, mode: str, pattern: str) -> bool:
+        '''Checks whether the pattern's reply is cached, without counting a hit or a miss'''
+        with self.lock:
+            return (mode, pattern) in self.entries
+
+    def put(self, mode: str, pattern: str, reply: bytes):
+        '''Stores the reply for the pattern, evicting least recently used replies to stay within max_bytes'''
+        if len(reply) > self.max_bytes:
+            return
+
+        with self.lock:
+            old = self.entries.pop((mode, pattern), None)
+            if old is not None:
+                self.size -= len(old)
+
+            self.entries[(mode, pattern)] = reply
+            self.size += len(reply)
+            while self.size > self.max_bytes:
+                _, evicted = self.entries.popitem(last=False)
+                self.size -= len(evicted)
+                self.evictions += 1
+
+    def invalidate(self):
+        '''Drops every cached reply'''
+        with self.lock:
+            self.entries.clear()
+            self.size = 0
+
+    def stats(self) -> dict[str, int | float]:
+        '''Returns the hit/miss counters and the current size of the cache'''
+        with self.lock:
+            lookups = self.hits + self.misses
+            return {
+                'hits': self.hits,
+                'misses': self.misses,
+                'hit_rate': self.hits / lookups if lookups else 0.0,
+                'evictions': self.evictions,
+                'entries': len(self.entries),
+                'bytes': self.size,
+                'max_bytes': self.max_bytes,
+            }
+
+shared_cache = QueryCache()     # one cache for every server of the process, keyed by their cache_mode
@@ -0,0 +1,54 @@
+'''Single-pass compiled-regex matching engine over a newline-joined dictionary buffer'''
+import re
+from collections.abc import Iterator
+
+class RegexEngine():
+    '''Compiles a "?" pattern into one regular expression and scans the whole dictionary with it at once.
+
+    The words are joined by newlines into a single buffer so re.finditer does the per-word work in C.
+    With substring=False a pattern must match a whole line (BasicServer/ThreadServer) and only the
+    buffer of words with the pattern's length is scanned, otherwise it may match anywhere inside a
+    line of the full dictionary (ExtraServer).
+    '''
+    def __init__(self, words: list[str], substring: bool=False):
+        self.substring = substring
+        self.buffers: dict[int, str] = {}   # whole-word mode: newline-joined words of each length
+        self.buffer = ''                    # substring mode: newline-joined dictionary
+        
+        if substring:
+            self.buffer = '\n'.join(words)
+        else:
+            buckets: dict[int, list[str]] = {}
+            for word in words:
+                buckets.setdefault(len(word), []).append(word)
+            self.buffers = {length: '\n'.join(bucket) for length, bucket in buckets.items()}
+
+    def compile(self, target: str) -> re.Pattern:
+        '''Turns a "?" pattern into a regex that matches the lines of the buffer containing a match'''
+        pattern = ''.join('[^\n]' if c == '?' else re.escape(c) for c in target)    # wildcard matches any char but the separator
+        if self.substring:
+            pattern = f'.*?{pattern}.*'   # match the whole line around the first occurrence
+        return re.compile(f'^{pattern}$', re.MULTILINE)
+
+    def find(self, target: str) -> tuple[list[str], int]:
+        '''Return all words matching the target pattern and the number of matches'''
+        buffer = self.buffer if self.substring else self.buffers.get(len(target))
+        if buffer is None:  # no word has the pattern's length
+            return [], 0
+
+        word_list = [match.group() for match in self.compile(target).finditer(buffer)]
+        return word_list, len(word_list)
+
+    def iter_matches(self, target: str) -> Iterator[str]:
+        '''Yields the words matching the target pattern one at a time'''
+        buffer = self.buffer if self.substring else self.buffers.get(len(target))
+        if buffer is not None:
+            for match in self.compile(target).finditer(buffer):
+                yield match.group()
+
+    def count(self, target: str) -> int:
+        '''Return the number of words matching the target pattern without building the words'''
+        buffer = self.buffer if self.substring else self.buffers.get(len(target))
+        if buffer is None:
+            return 0
+        return sum(1 for _ in self.compile(target).finditer(buffer))
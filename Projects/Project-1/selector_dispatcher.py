@@ -0,0 +1,216 @@
+'''selectors dispatcher serving a word server's queries to many clients from one thread with non-blocking sockets'''
+import selectors
+import socket
+import time
+from collections import deque
+from collections.abc import Iterator
+from framing import PROTO_PREFIX, VERSION, HEADER, MAX_PAYLOAD, ERROR, RESPONSE, FramingError, encode_frame, decode_header, parse_upgrade, answer_frame
+from protocol import iter_reply, COMPRESS_PREFIX, negotiate_compression
+from serving import stream_threshold
+
+def now():
+    return time.ctime(time.time())
+
+class Client():
+    '''State of one connection: bytes received but not yet answered, and reply bytes not yet sent'''
+    def __init__(self, sock: socket.socket, address):
+        self.sock = sock
+        self.address = address
+        self.inbox = bytearray()    # framed requests not handled yet
+        self.outbox: deque[bytes | memoryview] = deque()     # reply bytes waiting for the socket to accept them
+        self.chunks: Iterator[bytes] | None = None  # rest of a streamed reply, produced only as it is sent
+        self.events = selectors.EVENT_WRITE     # the "200 OK" handshake goes out first
+        self.compress = False   # until the client negotiates compression
+        self.framed = False     # until the client upgrades to the framed protocol
+        self.closing = False    # hang up once the outbox is sent
+
+class SelectorDispatcher():
+    '''Accepts clients on one thread with the selectors module and speaks the same protocol as the other dispatchers.
+
+    Every socket is non-blocking. A client is either waiting for its next query or being sent its
+    reply, never both: the dispatcher stops reading from a client until its reply is out, and produces
+    a streamed reply one chunk at a time as the socket accepts it. A slow reader therefore holds at
+    most one chunk in memory and never keeps the loop from serving everyone else. Queries are answered
+    on the dispatcher thread, so one expensive query delays the others for its duration.
+    '''
+    def __init__(self, server, backlog: int=1024):
+        self.server = server        # any word server with host, port, getReply and metrics
+        self.backlog = backlog
+        self.selector: selectors.BaseSelector | None = None
+        self.listener: socket.socket | None = None
+        self.running = False
+
+    def start(self) -> socket.socket:
+        '''Starts listening and returns the listening socket, clients are handled once serve runs'''
+        self.listener = socket.create_server((self.server.host, self.server.port), backlog=self.backlog)
+        self.listener.setblocking(False)
+        self.selector = selectors.DefaultSelector()    # epoll on Linux
+        self.selector.register(self.listener, selectors.EVENT_READ)  # no data marks the listener
+        print('Server started up on %s at %s' % (self.server.host, now()))
+        return self.listener
+
+    def serve(self, timeout: float=1.0):
+        '''Handles clients until stop is called, waking at least every timeout seconds to check for it'''
+        self.running = True
+        while self.running:
+            for key, events in self.selector.select(timeout):
+                if key.data is None:
+                    self.accept()
+                    continue
+
+                client = key.data
+                if events & selectors.EVENT_READ:
+                    self.read(client)
+                elif events & selectors.EVENT_WRITE:
+                    self.write(client)
+
+    def stop(self):
+        '''Makes serve return after its current round of events'''
+        self.running = False
+
+    def close(self):
+        '''Closes the listener and every client connection'''
+        if self.selector is None:
+            return
+        for key in list(self.selector.get_map().values()):
+            key.fileobj.close()
+        self.selector.close()
+        self.selector = self.listener = None
+
+    def accept(self):
+        '''Accepts every pending connection'''
+        while True:
+            try:
+                sock, address = self.listener.accept()
+            except (BlockingIOError, InterruptedError):
+                return
+            print(f'Server connected with {address} at {now()}')
+            sock.setblocking(False)
+            self.server.metrics.opened()
+            client = Client(sock, address)
+            client.outbox.append(b'200 OK')     # initial handshake to inform client that server is ready
+            self.selector.register(sock, client.events, client)
+
+    def disconnect(self, client: Client):
+        '''Closes one client connection'''
+        print('Client at', client.address, 'disconnected at', now())
+        self.selector.unregister(client.sock)
+        client.sock.close()
+        self.server.metrics.closed()
+
+    def read(self, client: Client):
+        '''Receives and handles the next query of a client'''
+        try:
+            data = client.sock.recv(65536 if client.framed else 1024)   # receive data from client (their pattern query)
+        except (BlockingIOError, InterruptedError):
+            return
+        except ConnectionError as e:
+            print('Error receiving data from client:', e)
+            self.disconnect(client)
+            return
+        if not data:
+            self.disconnect(client)
+            return
+
+        try:
+            if client.framed:
+                client.inbox += data
+            elif data.startswith(PROTO_PREFIX):     # client upgrades the connection to the framed protocol
+                self.upgrade(client, data)
+            elif data.startswith(COMPRESS_PREFIX):  # client asks for large replies to be compressed
+                client.compress, answer = negotiate_compression(data)
+                client.outbox.append(answer)
+            else:   # large replies are streamed in bounded chunks
+                client.chunks = iter_reply(self.server, data.decode(), threshold=stream_threshold(self.server), compress=client.compress)
+            self.update(client)
+        except Exception as e:  # one bad client must not take the loop down with it
+            print('Error handling client:', e)
+            self.disconnect(client)
+
+    def upgrade(self, client: Client, data: bytes):
+        '''Answers a "PROTO" line, switching the connection to framed requests'''
+        version, rest = parse_upgrade(data)
+        if version != VERSION:
+            client.outbox.append(f'400 unsupported protocol version, expected {VERSION}\n'.encode())
+            client.closing = True
+            return
+        client.outbox.append(f'200 PROTO {VERSION}\n'.encode())
+        client.framed = True
+        client.inbox += rest
+
+    def answerFrame(self, client: Client):
+        '''Queues the reply to the client's next complete request frame, if it has sent one'''
+        if len(client.inbox) < HEADER.size:
+            return
+        try:
+            opcode, _, request_id, length = decode_header(bytes(client.inbox[:HEADER.size]))
+            if length > MAX_PAYLOAD:
+                raise FramingError(f'Frame of {length} bytes is too large')
+        except FramingError as e:   # the stream can not be resynchronised, report and hang up
+            client.outbox.append(encode_frame(ERROR | RESPONSE, 0, str(e).encode()))
+            client.closing = True
+            return
+
+        end = HEADER.size + length
+        if len(client.inbox) < end:
+            return
+        payload = bytes(client.inbox[HEADER.size:end])
+        del client.inbox[:end]
+        client.outbox.append(answer_frame(opcode, request_id, payload, self.server.getReply))
+
+    def update(self, client: Client):
+        '''Refills an empty outbox with the next part of the client's output and selects the events to wait for'''
+        if not client.outbox:
+            if client.chunks is not None:
+                chunk = next(client.chunks, None)
+                if chunk is None:
+                    client.chunks = None
+                else:
+                    client.outbox.append(chunk)
+            if client.chunks is None and client.framed and not client.closing:
+                self.answerFrame(client)    # pipelined requests are answered one at a time, as their replies go out
+
+        if not client.outbox and client.closing:
+            self.disconnect(client)
+            return
+        events = selectors.EVENT_WRITE if client.outbox else selectors.EVENT_READ
+        if events != client.events:
+            client.events = events
+            self.selector.modify(client.sock, events, client)
+
+    def write(self, client: Client):
+        '''Sends as much of the client's outbox as the socket accepts without blocking'''
+        while client.outbox:
+            pending = client.outbox[0]
+            try:
+                sent = client.sock.send(pending)
+            except (BlockingIOError, InterruptedError):
+                break
+            except ConnectionError as e:
+                print('Error sending reply to client:', e)
+                self.disconnect(client)
+                return
+            if sent < len(pending):     # partial write, the rest waits until the socket is writable again
+                client.outbox[0] = memoryview(pending)[sent:]
+                break
+            client.outbox.popleft()
+
+        try:
+            self.update(client)
+        except Exception as e:
+            print('Error handling client:', e)
+            self.disconnect(client)
+
+    def dispatcher(self):
+        '''Starts the server, listen for incoming connections, handle clients concurrently on one thread'''
+        print('Starting server on %s:%s' % (self.server.host, self.server.port))
+        try:
+            self.start()
+            self.serve()
+        except KeyboardInterrupt:
+            print('Server shutting down...')
+        except OSError as e:
+            print('Error starting server:', e)
+        finally:
+            self.close()
+            print('Server socket closed.')
@@ -0,0 +1,180 @@
+'''Query answering shared by the word servers: the reply cache, metrics, profiling and word list swaps
+
+Each function takes the server as its first argument, like iter_reply and page_reply. A server
+provides the matching (findQuery, countQuery, iterQuery), the StoreView it answers from, the cache,
+metrics and profiler attributes, a mode naming its matching semantics, a cache_mode its replies are
+cached under (with the version of the word list they come from), and buildReply computing an
+uncached reply.
+'''
+import time
+from pattern_trie import PatternTrie
+from protocol import COUNT, BATCH, STATS, PROFILE, STREAM_THRESHOLD, MAX_BATCH_MATCHES, MAX_BATCH_BYTES, QueryError, parse_query, page_reply
+from protocol import encode_reply, encode_count, encode_batch, encode_error, encode_stats, compress_reply, decompress_reply
+from wordstore import WordStore, reload_store
+
+def now():
+    return time.ctime(time.time())
+
+class StoreView():
+    '''The word list a server answers from: its store and the views of it the server matches against.
+
+    use_store swaps in a whole new one. A query reads server.view once and hands it to every
+    matching method it calls, so finding, counting and paging all see the same word list, and its
+    reply is cached under the view's cache_mode, which names that word list.
+    '''
+    def __init__(self, store: WordStore, word_set, word_buckets=None, engine=None):
+        self.store = store
+        self.cache_mode = ''                # set by use_store
+        self.word_set = word_set            # words scanned when there is no engine
+        self.word_buckets = word_buckets    # words of each length, for whole-word matching
+        self.engine = engine                # None when the server's own loop is used
+
+def cache_mode(server) -> str:
+    '''Returns the key a server's replies are cached under in a cache shared with other servers.
+
+    Servers only share replies when they match the same way (mode), over the same words (unique drops
+    duplicates) and with the same engine, whose replies may list the words in another order. Replies
+    are cached under it followed by the version of their word list, see use_store.
+    '''
+    return f"{server.mode} {'unique' if server.unique else 'all'} {server.engine_name}"
+
+def stream_threshold(server) -> int | None:
+    '''Returns the threshold iter_reply streams a server's replies above, None when it builds them all.
+
+    Worker processes build whole replies, so a server running queries in them never streams.
+    '''
+    return STREAM_THRESHOLD if getattr(server, 'pool', None) is None else None
+
+def get_reply(server, query: str, compress: bool=False) -> bytes:
+    '''Returns the encoded reply to a client query, counted in the metrics and profiled during a PROFILE session'''
+    start = time.perf_counter()
+    if server.profiler.kind is None or query.lstrip().startswith(PROFILE):  # the PROFILE commands themselves are not profiled
+        reply = lookup_reply(server, query, compress)
+    else:   # a PROFILE session is running
+        reply = server.profiler.call(lookup_reply, server, query, compress)
+    server.metrics.record(query, time.perf_counter() - start, len(reply), reply.startswith(b'400 '))
+    return reply
+
+def lookup_reply(server, query: str, compress: bool=False) -> bytes:
+    '''Returns the encoded reply to a client query, reusing the cached reply when there is one.
+
+    Large replies are cached compressed, so compress (set for clients that negotiated it) serves a
+    hit as it is while other clients get it decompressed.
+    '''
+    try:
+        command, pattern, options = parse_query(query)
+        if command == STATS:    # live numbers, never cached
+            return encode_stats(server.stats())
+        if command == PROFILE:
+            return server.profiler.command(pattern, options)
+        if options:     # one page of the matches, bounded work so it is not worth caching
+            return page_reply(server, pattern, options)
+    except QueryError as e:
+        return encode_error(str(e))
+
+    view = server.view  # the reply is built from and cached under the same word list
+    mode = view.cache_mode if command is None else f'{view.cache_mode} {command}'   # count replies are cached apart
+    if server.cache is not None:
+        reply = server.cache.get(mode, pattern)
+        if reply is not None:
+            return reply if compress else decompress_reply(reply)
+
+    try:
+        reply = server.buildReply(command, pattern, view)
+    except QueryError as e:     # a batch too large to build
+        return encode_error(str(e))
+    if not compress and server.cache is None:
+        return reply
+    packed = compress_reply(reply)
+    if server.cache is not None:
+        server.cache.put(mode, pattern, packed)
+    return packed if compress else reply
+
+def build_reply(server, command: str | None, pattern: str, view: StoreView | None=None) -> bytes:
+    '''Computes the encoded reply to a parsed query, from view or else the server's current one'''
+    view = view or server.view
+    if command == COUNT:
+        return encode_count(server.countQuery(pattern, view))  # constant-size reply, no list of words built
+    if command == BATCH:
+        return encode_batch(server.batchQuery(pattern.split(), view))
+
+    words, matches = server.findQuery(pattern, view)    # find all words matching the client's pattern query
+    return encode_reply(words, matches)
+
+def batch_too_large() -> QueryError:
+    '''Returns the error answered to a batch whose reply would be too large to build'''
+    return QueryError(f'batch of more than {MAX_BATCH_MATCHES} matches or {MAX_BATCH_BYTES} bytes of words, query its broad patterns on their own')
+
+def batch_query(server, targets: list[str], view: StoreView | None=None) -> list[tuple[list[str], int]]:
+    '''Returns the matching words and number of matches of every target pattern, in order.
+
+    Engines answer each distinct pattern from their index, repeated patterns once. Without one, whole
+    word matching scans each word length once and substring matching makes one pass over the word
+    list, matching every word (or window of it) against all the patterns in one walk of their trie.
+    The reply of a batch is built whole, so a batch adding up to more than MAX_BATCH_MATCHES words or
+    MAX_BATCH_BYTES bytes of words is a QueryError, raised before more than that is collected.
+    '''
+    view = view or server.view
+    repeats = {target: targets.count(target) for target in dict.fromkeys(targets)}  # the reply repeats a repeated pattern's words
+    if view.engine is not None:
+        if sum(view.engine.count(target) * repeat for target, repeat in repeats.items()) > MAX_BATCH_MATCHES:   # counted without building the words
+            raise batch_too_large()
+        results, size = {}, 0
+        for target, repeat in repeats.items():
+            results[target] = view.engine.find(target)
+            size += sum(len(word) + 2 for word in results[target][0]) * repeat
+            if size > MAX_BATCH_BYTES:
+                raise batch_too_large()
+        return [results[target] for target in targets]
+
+    found: dict[str, list[str]] = {target: [] for target in targets}
+    matches = size = 0
+    if server.mode == 'substring':
+        trie = PatternTrie(found)
+        for word in view.word_set:
+            for target in trie.search(word):
+                found[target].append(word)
+                matches += repeats[target]
+                size += (len(word) + 2) * repeats[target]
+            if matches > MAX_BATCH_MATCHES or size > MAX_BATCH_BYTES:
+                raise batch_too_large()
+    else:
+        by_length: dict[int, list[str]] = {}
+        for target in found:
+            by_length.setdefault(len(target), []).append(target)
+        for length, group in by_length.items():
+            trie = PatternTrie(group)
+            for word in view.word_buckets.get(length, []):   # one pass over the bucket for the whole group
+                for target in trie.match(word):
+                    found[target].append(word)
+                    matches += repeats[target]
+                    size += (len(word) + 2) * repeats[target]
+                if matches > MAX_BATCH_MATCHES or size > MAX_BATCH_BYTES:
+                    raise batch_too_large()
+
+    return [(found[target], len(found[target])) for target in targets]
+
+def server_stats(server) -> dict:
+    '''Returns the metrics of a server and its cache, answered to STATS queries'''
+    view = server.view
+    stats = {'server': type(server).__name__, 'mode': server.mode, 'engine': server.engine_name, 'words': len(view.word_set), 'version': view.store.version.hex()}
+    stats.update(server.metrics.stats())
+    stats['cache'] = server.cache.stats() if server.cache is not None else None
+    return stats
+
+def use_store(server, view: StoreView):
+    '''Makes a server answer the next queries from view.
+
+    The view is built by the caller and swapped in with one assignment. Queries already running hold
+    the previous view, so they finish consistently against the previous store. Cached replies are
+    keyed by the version of the word list they come from, so servers sharing a cache over different
+    lists never answer from each other's replies, and those of a previous list age out of the cache.
+    '''
+    view.cache_mode = f'{server.cache_mode} {view.store.version.hex()}'
+    server.view = view
+
+def reload_words(server):
+    '''Loads the word list again and swaps it into a server, without dropping connected clients'''
+    print(f'Reloading the word list at {now()}')
+    server.useStore(reload_store())
+    print(f'Word list reloaded at {now()}')
@@ -0,0 +1,148 @@
+'''Suffix array over the newline-joined dictionary for ExtraServer substring queries'''
+import hashlib
+import os
+from collections.abc import Iterator
+from array import array
+from bisect import bisect_left, bisect_right
+
+SA_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'wordlist.sa')
+SA_MAGIC = b'WQSA2\n'
+
+class SuffixArrayIndex():
+    '''Sorted suffixes of every word, searched by binary search with backtracking over "?" positions.
+
+    Leading and trailing wildcards of a pattern are not searched: they only require enough characters
+    before and after an occurrence of the remaining core inside its word. Occurrences are mapped back
+    to word IDs without duplicates and returned in word list order.
+    '''
+    def __init__(self, words: list[str], suffixes: array | None=None):
+        self.words = list(words)
+        self.text = '\n'.join(self.words) + '\n'    # every word, suffixes stop at its terminating newline
+        self.starts = array('I')    # offset of each word in the text
+        self.word_of = array('I')   # word ID of each text position
+        self.at_least = [0] * (max((len(word) for word in self.words), default=0) + 2)     # number of words of at least each length
+
+        offset = 0
+        for word_id, word in enumerate(self.words):
+            self.starts.append(offset)
+            self.word_of.extend([word_id] * (len(word) + 1))
+            offset += len(word) + 1
+            self.at_least[len(word)] += 1
+        for length in range(len(self.at_least) - 2, -1, -1):
+            self.at_least[length] += self.at_least[length + 1]
+
+        if suffixes is None:
+            suffixes = self.build()
+        self.suffixes = suffixes
+
+    def build(self) -> array:
+        '''Sorts the start positions of all word suffixes (newlines excluded) by the suffix up to its word's end.
+
+        The key keeps the terminating newline, which search compares against: control characters in the
+        word list sort below it, so a key without it would order suffixes differently from the bisect.
+        '''
+        text = self.text
+        positions = [i for i, c in enumerate(text) if c != '\n']
+        positions.sort(key=lambda i: text[i:text.index('\n', i) + 1])
+        return array('I', positions)
+
+    def digest(self) -> bytes:
+        '''Fingerprint of the indexed words, used to detect a saved suffix array that is stale'''
+        return hashlib.sha1(self.text.encode()).digest()
+
+    def save(self, path: str=SA_PATH):
+        '''Writes the suffix array so a server can load it at startup instead of sorting again, atomically replacing the file'''
+        temp_path = f'{path}.{os.getpid()}.tmp'
+        with open(temp_path, 'wb') as f:
+            f.write(SA_MAGIC + self.digest())
+            self.suffixes.tofile(f)
+        os.replace(temp_path, path)     # servers never load a half-written suffix array
+
+    @classmethod
+    def load(cls, words: list[str], path: str=SA_PATH) -> 'SuffixArrayIndex':
+        '''Loads the suffix array saved for these words, building (and saving) it again if missing, stale or truncated'''
+        index = cls(words, suffixes=array('I'))
+        try:
+            with open(path, 'rb') as f:
+                header = f.read(len(SA_MAGIC) + 20)
+                payload = f.read()
+            positions = len(index.text) - index.text.count('\n')     # one suffix per character of a word
+            if header == SA_MAGIC + index.digest() and len(payload) == positions * index.suffixes.itemsize:
+                index.suffixes.frombytes(payload)
+                return index
+        except OSError:
+            pass
+
+        index.suffixes = index.build()
+        try:
+            index.save(path)
+        except OSError as e:    # read-only checkout, keep serving from memory
+            print('Could not save suffix array:', e)
+        return index
+
+    def search(self, core: str, lo: int, hi: int, depth: int=0) -> list[tuple[int, int]]:
+        '''Returns the suffix array ranges whose suffixes start with the core pattern'''
+        text, suffixes = self.text, self.suffixes
+        while depth < len(core):
+            c = core[depth]
+            key = lambda position: text[position + depth]
+            if c != '?':    # literal: narrow the range down to the suffixes with c at this depth
+                lo = bisect_left(suffixes, c, lo, hi, key=key)
+                hi = bisect_right(suffixes, c, lo, hi, key=key)
+                if lo == hi:
+                    return []
+                depth += 1
+                continue
+
+            ranges = []     # wildcard: backtrack into every character present at this depth
+            while lo < hi:
+                next_c = key(suffixes[lo])
+                end = bisect_right(suffixes, next_c, lo, hi, key=key)
+                if next_c != '\n':  # the word ended, a wildcard can not match here
+                    ranges.extend(self.search(core, lo, end, depth + 1))
+                lo = end
+            return ranges
+
+        return [(lo, hi)]
+
+    def match(self, target: str) -> set[int]:
+        '''Returns the IDs of the words matching a target pattern that contains at least one literal'''
+        core = target.strip('?')
+        before = len(target) - len(target.lstrip('?'))  # characters the word needs before the core
+        after = len(target) - len(target.rstrip('?'))   # characters the word needs after the core
+        word_ids = set()
+        for lo, hi in self.search(core, 0, len(self.suffixes)):
+            for position in self.suffixes[lo:hi]:
+                word_id = self.word_of[position]
+                start = self.starts[word_id]
+                if position - start >= before and start + len(self.words[word_id]) - position - len(core) >= after:
+                    word_ids.add(word_id)
+        return word_ids
+
+    def find(self, target: str) -> tuple[list[str], int]:
+        '''Return all words matching the target pattern and the number of matches'''
+        if not target.strip('?'):   # only wildcards: any word at least as long as the pattern contains a match
+            word_list = [word for word in self.words if len(word) >= len(target)]
+            return word_list, len(word_list)
+
+        word_list = [self.words[word_id] for word_id in sorted(self.match(target))]
+        return word_list, len(word_list)
+
+    def iter_matches(self, target: str) -> Iterator[str]:
+        '''Yields the words matching the target pattern one at a time'''
+        if not target.strip('?'):
+            yield from (word for word in self.words if len(word) >= len(target))
+        else:   # occurrences must be deduplicated first, only the words are produced lazily
+            yield from (self.words[word_id] for word_id in sorted(self.match(target)))
+
+    def count(self, target: str) -> int:
+        '''Return the number of words matching the target pattern without building the words'''
+        if not target.strip('?'):
+            return self.at_least[min(len(target), len(self.at_least) - 1)]
+        return len(self.match(target))
+
+if __name__ == '__main__':  # build the suffix array offline so servers only load it at startup
+    with open(os.path.join(os.path.dirname(SA_PATH), 'wordlist.txt'), 'r') as f:
+        index = SuffixArrayIndex(f.read().splitlines())
+    index.save()
+    print(f'Saved {len(index.suffixes)} suffixes to {SA_PATH}')
@@ -1,12 +1,16 @@
 from socket import socket, AF_INET, SOCK_STREAM
+import zlib
 
 serverHost = 'localhost'
 serverPort = 50007
+compression = 'zlib'    # asked for after the handshake, servers then compress large replies
+compressedMarker = b'Z\n'   # starts a compressed reply, followed by one complete zlib stream
 
 class ThreadClient():
-    def __init__(self, host: str=serverHost, port: int=serverPort):
+    def __init__(self, host: str=serverHost, port: int=serverPort, compress: bool=True):
         self.serverHost = host
         self.serverPort = port
+        self.compress = compress    # ask the server to compress large replies
         self.server_socket: None | socket = None
 
     def connectToServer(self):
@@ -26,12 +30,47 @@ class ThreadClient():
         print(f'Connected to server at {(self.serverHost, self.serverPort)}, waiting in queue...')
         
         reply = sock.recv(1024).decode()    # wait for server readiness message
+        if reply.startswith('503'):     # server is saturated, it tells how long to wait before trying again
+            print(f'Server busy, try again later ({reply.strip()})')
+            sock.close()
+            return None
         if reply == '200 OK':
             print('Server ready.')
         
+        if self.compress:   # servers without compression answer with an empty pattern reply instead
+            sock.send(f'COMPRESS {compression}'.encode())
+            if self.receiveReply(sock) == f'200 COMPRESS {compression}\n':
+                print('Compression enabled.')
+        
         self.server_socket = sock   # update connected socket
         return sock
 
+    def receiveReply(self, sock: socket) -> str:
+        '''Receives one full reply from the server, decompressing it if it was sent compressed'''
+        reply = b''
+        while len(reply) < len(compressedMarker) and not reply.endswith(b'\n'):   # enough to tell the two forms apart
+            data = sock.recv(1024)
+            if not data:
+                raise ConnectionError('Server closed the connection mid-reply')
+            reply += data
+        
+        if reply.startswith(compressedMarker):  # one zlib stream, complete once the decompressor reaches its end
+            decompressor = zlib.decompressobj()
+            text = decompressor.decompress(reply[len(compressedMarker):])
+            while not decompressor.eof:
+                data = sock.recv(65536)
+                if not data:
+                    raise ConnectionError('Server closed the connection mid-reply')
+                text += decompressor.decompress(data)
+            return text.decode()
+        
+        while reply.endswith(b'\n') is False:  # keep receiving until full reply is obtained
+            data = sock.recv(1024)
+            if not data:
+                raise ConnectionError('Server closed the connection mid-reply')
+            reply += data
+        return reply.decode()
+
     def closeConnection(self) -> bool:
         '''Closes the connection to the server'''
         if self.server_socket is not None:
@@ -79,9 +118,7 @@ class ThreadClient():
                     continue
 
                 try:
-                    reply = sock.recv(1024).decode()    # receive server reply
-                    while reply.endswith('\n') is False:  # keep receiving until full reply is obtained
-                        reply += sock.recv(1024).decode()
+                    reply = self.receiveReply(sock)    # receive server reply
                     
                     print('Server reply:\n', reply)
                         
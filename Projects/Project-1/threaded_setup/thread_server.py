@@ -1,7 +1,21 @@
 import time, _thread as thread
 import threading
 from socket import socket, AF_INET, SOCK_STREAM
-from concurrent.futures import ThreadPoolExecutor
+from collections.abc import Iterator
+from concurrent.futures import ThreadPoolExecutor, ProcessPoolExecutor
+import multiprocessing
+import os, sys, tempfile
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))    # shared modules live in the project root
+from protocol import COUNT, COMPRESS_PREFIX, negotiate_compression, iter_reply
+from query_cache import QueryCache, shared_cache
+from metrics import ServerMetrics
+from profiling import Profiler
+from framing import PROTO_PREFIX, serve_framed
+from wordstore import WordStore, get_store, reload_store, reload_on_signal
+from serving import StoreView, cache_mode, stream_threshold, get_reply, build_reply, batch_query, server_stats, use_store, reload_words
+from async_dispatcher import AsyncDispatcher
+from selector_dispatcher import SelectorDispatcher
+from admission import AdmissionControl
 
 myHost = 'localhost'
 myPort = 50007
@@ -9,22 +23,63 @@ myPort = 50007
 def now():
     return time.ctime(time.time())
 
+worker_server: 'ThreadServer | None' = None     # server of a query worker process
+
+def init_worker(engine: str):
+    '''Builds the server of a query worker process, a forked worker reuses the dictionary it inherited, others load it'''
+    global worker_server
+    worker_server = ThreadServer(engine=engine, cache=None)
+
+def worker_reply(command: str | None, pattern: str, version: bytes | None=None) -> bytes | None:
+    '''Answers one query in a worker process, only the query and the encoded reply cross the process boundary.
+
+    Returns None when the worker's word list is not the given version, one a reload replaced.
+    '''
+    if version is not None and version != worker_server.view.store.version:
+        return None
+    return worker_server.buildReply(command, pattern)
+
 class ThreadServer():
-    def __init__(self, host: str=myHost, port: int=myPort):
+    mode = 'word'  # matching semantics, part of the cache key, whole-word matches
+    unique = False  # matches every word of the list, duplicates included
+
+    def __init__(self, host: str=myHost, port: int=myPort, engine: str='index', cache: QueryCache | None=shared_cache, processes: int=0, max_pending: int=32, slow_ms: float | None=None, profile_dir: str=tempfile.gettempdir()):
         self.host = host
         self.port = port
-        self.word_set = self.get_word_list()
+        self.cache = cache  # shared reply cache, None disables caching
+        self.engine_name = engine
+        self.cache_mode = cache_mode(self)   # servers matching another way never share cached replies
+        self.metrics = ServerMetrics(slow_ms)   # per-query counters and latencies, read with the STATS command, queries over slow_ms are logged
+        self.profiler = Profiler(profile_dir, type(self).__name__)   # PROFILE sessions write their files to profile_dir
+        self.processes = processes  # query worker processes, 0 answers queries in the client's thread
+        self.pool: ProcessPoolExecutor | None = None
+        self.admission = AdmissionControl(max_pending)  # clients beyond max_pending waiting for a thread are told to retry
+        self.useStore(get_store())  # dictionary shared by every server of the process
         
-    def get_word_list(self) -> list[str]:
-        '''Loads word list from file into a set'''
-        word_list = []
-        
-        with open('../wordlist.txt', 'r') as f:
-            words = f.read().splitlines()   # Read lines without trailing newlines and store each line as an element in a list
-            for word in words:
-                word_list.append(word)  # add each word to the list
+    def useStore(self, store: WordStore):
+        '''Answers the next queries from store, see serving.use_store'''
+        engine = store.engine(self.engine_name)     # None when the loop in findQuery is used
+        use_store(self, StoreView(store, store.words, store.buckets, engine))   # buckets group words by length so a query only scans words that could match
+
+    def reload(self):
+        '''Loads the word list again and swaps it in, without dropping connected clients.
 
-        return word_list
+        Query worker processes hold a copy of the old store, so a new pool is started and swapped in
+        before the store, then the old pool finishes the queries it is running. Client threads are
+        running by now and forking copies whatever locks they hold, so the new workers are started
+        from a clean process and load the new word list themselves.
+        '''
+        if self.pool is None:
+            reload_words(self)
+            return
+
+        print(f'Reloading the word list at {now()}')
+        store = reload_store()
+        methods = multiprocessing.get_all_start_methods()
+        old, self.pool = self.pool, self.makePool('forkserver' if 'forkserver' in methods else 'spawn')
+        self.useStore(store)    # after the pool swap, so the new list is rarely answered by old workers (see buildReply)
+        old.shutdown(wait=True)
+        print(f'Word list reloaded at {now()}')
 
     def checkWord(self, word: str, target: str) -> bool:
         '''Checks if a word matches the target pattern'''
@@ -42,21 +97,100 @@ class ThreadServer():
             
         return True
 
-    def findQuery(self, target: str) -> tuple[list[str], int]:
+    def findQuery(self, target: str, view: StoreView | None=None) -> tuple[list[str], int]:
         '''Return all words matching the target pattern in the word set and the number of matches'''
+        view = view or self.view  # one word list for the whole query
+        if view.engine is not None:     # let the selected engine answer instead of scanning
+            return view.engine.find(target)
+
         word_list = []  # list of words that match the target pattern
         matches = 0     # number of words that match the target pattern
-        for word in self.word_set:
+        for word in view.word_buckets.get(len(target), []):    # only words of the target's length can match
             if self.checkWord(word, target):
                 word_list.append(word)
                 matches += 1
 
         return word_list, matches
 
+    def iterQuery(self, target: str, view: StoreView | None=None) -> Iterator[str]:
+        '''Yields the words matching the target pattern one at a time, for streaming replies'''
+        view = view or self.view  # one word list for the whole query
+        if view.engine is not None:
+            yield from view.engine.iter_matches(target)
+            return
+
+        for word in view.word_buckets.get(len(target), []):    # only words of the target's length can match
+            if self.checkWord(word, target):
+                yield word
+
+    def countQuery(self, target: str, view: StoreView | None=None) -> int:
+        '''Return the number of words matching the target pattern without building the list of words'''
+        view = view or self.view  # one word list for the whole query
+        if view.engine is not None:     # indexes count without allocating the matching words
+            return view.engine.count(target)
+
+        matches = 0
+        for word in view.word_buckets.get(len(target), []):    # only words of the target's length can match
+            if self.checkWord(word, target):
+                matches += 1
+
+        return matches
+
+    def batchQuery(self, targets: list[str], view: StoreView | None=None) -> list[tuple[list[str], int]]:
+        '''Return the matching words and number of matches of every target pattern, in order, see serving.batch_query'''
+        return batch_query(self, targets, view)
+
+    def getReply(self, query: str, compress: bool=False) -> bytes:
+        '''Returns the encoded reply to a client query, see serving.get_reply'''
+        return get_reply(self, query, compress)
+
+    def buildReply(self, command: str | None, pattern: str, view: StoreView | None=None) -> bytes:
+        '''Computes the encoded reply to a parsed query, in a worker process when there are any'''
+        view = view or self.view
+        pool = self.pool    # read once, a reload or a shutdown may replace it meanwhile
+        if pool is not None:    # pure-Python matching runs in a worker process, outside this process' GIL
+            try:
+                reply = pool.submit(worker_reply, command, pattern, view.store.version).result()
+                if reply is not None:
+                    return reply
+            except RuntimeError:    # the pool was shut down since it was read, answer in this thread
+                pass
+        return build_reply(self, command, pattern, view)    # also when the pool's workers hold another word list
+
+    def startWorkers(self):
+        '''Starts the query worker processes, before any client thread so forking copies a single thread'''
+        if self.processes <= 0 or self.pool is not None:
+            return
+
+        methods = multiprocessing.get_all_start_methods()
+        self.pool = self.makePool('fork' if 'fork' in methods else None)    # fork shares the loaded dictionary copy-on-write
+
+    def makePool(self, method: str | None) -> ProcessPoolExecutor:
+        '''Returns a pool of query worker processes started with the given multiprocessing start method'''
+        pool = ProcessPoolExecutor(self.processes, mp_context=multiprocessing.get_context(method), initializer=init_worker, initargs=(self.engine_name,))
+        pool.submit(worker_reply, COUNT, '').result()   # launch every worker now, not from a client thread
+        print(f'Started {self.processes} query worker processes')
+        return pool
+
+    def stopWorkers(self):
+        '''Stops the query worker processes once the running queries are done, later queries are answered in their client's thread'''
+        pool, self.pool = self.pool, None
+        if pool is not None:
+            pool.shutdown(wait=True)
+
+    def stats(self) -> dict:
+        '''Returns the metrics of the server, its cache and its admission control, answered to STATS queries'''
+        stats = server_stats(self)
+        stats['admission'] = self.admission.stats()  # queue depth, shed clients and queue wait
+        return stats
+
     def handleClient(self, connection: socket):
         '''Handles single client connection'''
+        self.metrics.opened()
         try:
+            address = connection.getpeername()  # a client that reset the connection has no peer name anymore
             connection.send('200 OK'.encode())  # initial handshake to inform client that server is ready
+            compress = False    # until the client negotiates compression
             
             while True:
                 try:
@@ -66,20 +200,24 @@ class ThreadServer():
                     break
                 if not data: break
 
-                words, matches = self.findQuery(data.decode())  # find all words matching the client's pattern query
-                
-                reply = f" (Total matches: {matches})\n"    # format reply message
-                if matches > 0:
-                    reply += ', '.join(words)
-                reply += '\n'
-                
-                connection.send(reply.encode()) # send reply to client
+                if data.startswith(PROTO_PREFIX):   # client upgrades the connection to the framed protocol
+                    serve_framed(connection, data, self.getReply)
+                    break
+
+                if data.startswith(COMPRESS_PREFIX):    # client asks for large replies to be compressed
+                    compress, answer = negotiate_compression(data)
+                    connection.sendall(answer)
+                    continue
+
+                for chunk in iter_reply(self, data.decode(), threshold=stream_threshold(self), compress=compress):  # large replies are streamed in bounded chunks
+                    connection.sendall(chunk)
                 
-            print('Client at', connection.getpeername(), 'disconnected at', now())  # log disconnection of client and time
+            print('Client at', address, 'disconnected at', now())  # log disconnection of client and time
         
         finally:    # ensure connection is closed and logged
             print('Closing connection...')
             connection.close()  
+            self.metrics.closed()
 
     def dispatcher(self):
         '''Starts the server, listen for incoming connections, handle clients concurrently using threads'''
@@ -88,29 +226,55 @@ class ThreadServer():
         try:    # start server socket and listen for connections
             client_socket = socket(AF_INET, SOCK_STREAM)
             client_socket.bind((self.host, self.port))
-            client_socket.listen(5)
+            client_socket.listen(128)   # accept bursts quickly, admission control decides who waits
             client_socket.settimeout(1.0)  # set timeout to allow periodic checks for shutdown
             print('Server started up on %s at %s' % (self.host, now()))
         except Exception as e:
             print('Error starting server:', e)
             return
 
-        with ThreadPoolExecutor(max_workers=1) as executor:
+        self.startWorkers()
+        with ThreadPoolExecutor(max_workers=max(1, 2 * self.processes)) as executor:    # enough client threads to keep every worker busy
             try:
                 while True:
                     try:
                         connection, address = client_socket.accept()    # accept incoming client connection
                     except TimeoutError:    # allow loop to continue on timeout
                         continue
-                    print(f'Server connected with {address} at {now()}')
-                    executor.submit(self.handleClient, connection)  # handle client connection in a separate thread
+                    if self.admission.submit(executor, self.handleClient, connection):  # handle client connection in a separate thread
+                        print(f'Server connected with {address} at {now()}')
+                    else:
+                        print(f'Server busy, shed {address} at {now()}: {self.admission.stats()}')
             except KeyboardInterrupt:
                 print('Server shutting down...')
             finally:
                 client_socket.close()  # stop accepting new connections
                 executor.shutdown(wait=True)    # wait for any current clients to finish
+                self.stopWorkers()
                 print('Server socket closed.')
 
+    def asyncDispatcher(self, workers: int=4):
+        '''Starts the server on an asyncio event loop, handle many clients concurrently with findQuery run in worker threads'''
+        self.startWorkers()
+        try:
+            AsyncDispatcher(self, max(workers, 2 * self.processes)).dispatcher()
+        finally:
+            self.stopWorkers()
+
+    def selectorDispatcher(self):
+        '''Starts the server on a selectors loop, handle many clients concurrently from one thread with non-blocking sockets'''
+        SelectorDispatcher(self).dispatcher()
+
 if __name__ == '__main__':
-    server = ThreadServer()
-    server.dispatcher()
\ No newline at end of file
+    processes = next((int(arg.split('=', 1)[1]) for arg in sys.argv if arg.startswith('--processes=')), 0)
+    max_pending = next((int(arg.split('=', 1)[1]) for arg in sys.argv if arg.startswith('--max-pending=')), 32)
+    slow_ms = next((float(arg.split('=', 1)[1]) for arg in sys.argv if arg.startswith('--slow-ms=')), None)     # --slow-ms=N logs queries taking N ms or more
+    profile_dir = next((arg.split('=', 1)[1] for arg in sys.argv if arg.startswith('--profile-dir=')), tempfile.gettempdir())    # where PROFILE sessions write their files
+    server = ThreadServer(processes=processes, max_pending=max_pending, slow_ms=slow_ms, profile_dir=profile_dir)     # --processes=N answers queries in N worker processes
+    reload_on_signal(server.reload)     # "kill -HUP <pid>" reloads wordlist.txt without dropping clients
+    if '--async' in sys.argv:   # event loop dispatcher instead of the thread pool
+        server.asyncDispatcher()
+    elif '--selectors' in sys.argv:     # non-blocking single-threaded dispatcher, queries answered on its thread
+        server.selectorDispatcher()
+    else:
+        server.dispatcher()
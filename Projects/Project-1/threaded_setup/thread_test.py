@@ -0,0 +1,217 @@
+from thread_server import ThreadServer
+from framing import FramedClient, FramingError, COUNT_QUERY
+from selector_dispatcher import SelectorDispatcher
+from admission import AdmissionControl
+from word_client import WordClient, AsyncWordClient
+from protocol import QueryError
+from wordstore import load_store
+from concurrent.futures import ThreadPoolExecutor
+from socket import socketpair
+from socket import socket, AF_INET, SOCK_STREAM
+import threading
+import asyncio
+import time
+import pytest
+
+def test_process_pool_replies_match_local_replies(tmp_path):
+    localServer = ThreadServer(engine='loop', cache=None)
+    poolServer = ThreadServer(engine='loop', cache=None, processes=2)
+    poolServer.startWorkers()
+    try:
+        for query in ['c?t', 'b??k', 'COUNT ?????', '3422']:
+            assert poolServer.getReply(query) == localServer.getReply(query)
+        
+        wordlist = tmp_path / 'words.txt'
+        wordlist.write_text('cat\ncot\n')
+        poolServer.useStore(load_store(str(wordlist), str(tmp_path / 'words.idx')))
+        assert poolServer.getReply('c?t') == b' (Total matches: 2)\ncat, cot\n'  # the workers hold another word list
+    finally:
+        poolServer.stopWorkers()
+    assert poolServer.pool is None
+
+def test_reload_replaces_process_pool_without_dropping_queries():
+    localServer = ThreadServer(engine='loop', cache=None)
+    poolServer = ThreadServer(engine='loop', cache=None, processes=1)
+    poolServer.startWorkers()
+    try:
+        old = poolServer.pool
+        poolServer.reload()
+        assert poolServer.pool is not old
+        assert poolServer.getReply('c?t') == localServer.getReply('c?t')
+        poolServer.pool.shutdown()  # a query that read the pool before it was shut down
+        assert poolServer.getReply('b??k') == localServer.getReply('b??k')
+    finally:
+        poolServer.stopWorkers()
+
+def serve_one_client(testServer: ThreadServer) -> int:
+    '''Accepts a single client in a background thread, returns the port to connect to'''
+    listener = socket(AF_INET, SOCK_STREAM)
+    listener.bind(('localhost', 0))
+    listener.listen(1)
+    
+    def accept():
+        connection, _ = listener.accept()
+        listener.close()
+        testServer.handleClient(connection)
+    
+    threading.Thread(target=accept, daemon=True).start()
+    return listener.getsockname()[1]
+
+def test_framed_protocol_pipelines_requests():
+    testServer = ThreadServer(cache=None)
+    client = FramedClient('localhost', serve_one_client(testServer), timeout=10)
+    client.connect()
+    try:
+        patterns = ['c?t', 'b??k', '3422', 'x' * 5000] * 25   # patterns longer than a recv(1024)
+        replies = client.pipeline(patterns)
+        assert replies == [testServer.getReply(pattern) for pattern in patterns]
+        
+        assert client.pipeline(['c?t'], opcode=COUNT_QUERY) == [b' (Total matches: 6)\n']
+        client.send('cat', opcode=0x55)     # unknown opcode, the connection stays usable
+        with pytest.raises(FramingError):
+            client.receive()
+        assert client.pipeline(['cat']) == [b' (Total matches: 1)\ncat\n']
+        assert client.batch(['c?t', '3422', 'cat']) == [testServer.getReply(pattern) for pattern in ['c?t', '3422', 'cat']]
+        with pytest.raises(QueryError):
+            client.batch([])
+        with pytest.raises(QueryError):     # its reply would be built whole, about 10 MB
+            client.batch(['????????'] * 100)
+        stats = client.stats()
+        assert stats['connections'] == {'accepted': 1, 'active': 1}
+        assert stats['queries']['batch']['requests'] == 3
+    finally:
+        client.close()
+
+def test_selector_dispatcher_is_not_stalled_by_slow_reader():
+    testServer = ThreadServer(host='localhost', port=0, cache=None)     # any free port
+    dispatcher = SelectorDispatcher(testServer)
+    port = dispatcher.start().getsockname()[1]
+    loop = threading.Thread(target=dispatcher.serve, kwargs={'timeout': 0.1}, daemon=True)
+    loop.start()
+    try:
+        slow = FramedClient('localhost', port, timeout=10)  # asks for large replies and never reads them
+        slow.connect()
+        for _ in range(100):
+            slow.send('????????')   # about 10 MB, more than the socket buffers hold
+        
+        clients = []
+        for _ in range(20):
+            sock = socket(AF_INET, SOCK_STREAM)
+            sock.settimeout(10)
+            sock.connect(('localhost', port))
+            clients.append(sock)
+        for sock in clients:
+            assert sock.recv(6) == b'200 OK'
+            sock.send(b'c?t')
+        for sock in clients:
+            reply = b''
+            while reply.count(b'\n') < 2:
+                reply += sock.recv(1024)
+            assert reply == testServer.getReply('c?t')
+            sock.close()
+        
+        framed = FramedClient('localhost', port, timeout=10)
+        framed.connect()
+        assert framed.pipeline(['c?t', 'b??k'] * 50) == [testServer.getReply(pattern) for pattern in ['c?t', 'b??k'] * 50]
+        framed.close()
+        slow.close()
+    finally:
+        dispatcher.stop()
+        loop.join()
+        dispatcher.close()
+
+def test_admission_control_sheds_beyond_max_pending():
+    admission = AdmissionControl(max_pending=2, retry_after=0.5)
+    release = threading.Event()
+    
+    def handle(connection):
+        release.wait(10)    # the only pool thread stays busy until released
+        connection.sendall(b'200 OK')
+        connection.close()
+    
+    pairs = [socketpair() for _ in range(5)]
+    with ThreadPoolExecutor(max_workers=1) as executor:
+        assert admission.submit(executor, handle, pairs[0][0])
+        while admission.stats()['active'] == 0:     # the pool thread picks up the first connection
+            time.sleep(0.01)
+        admitted = [admission.submit(executor, handle, server_side) for server_side, _ in pairs[1:]]
+        assert admitted == [True, True, False, False]   # two waiting, the rest shed
+        assert pairs[3][1].recv(1024) == b'503 BUSY retry-after=0.5\n'
+        stats = admission.stats()
+        assert (stats['active'], stats['pending'], stats['shed']) == (1, 2, 2)
+        release.set()
+    
+    assert all(client_side.recv(6) == b'200 OK' for _, client_side in pairs[:3])
+    assert admission.stats()['pending'] == admission.stats()['active'] == 0
+    for _, client_side in pairs:
+        client_side.close()
+
+def test_word_client_pools_pipelines_and_reconnects():
+    testServer = ThreadServer(host='localhost', port=0, cache=None)     # any free port
+    
+    def serve(port: int) -> tuple[SelectorDispatcher, threading.Thread]:
+        testServer.port = port
+        dispatcher = SelectorDispatcher(testServer)
+        dispatcher.start()
+        loop = threading.Thread(target=dispatcher.serve, kwargs={'timeout': 0.1}, daemon=True)
+        loop.start()
+        return dispatcher, loop
+    
+    def shutdown(dispatcher: SelectorDispatcher, loop: threading.Thread):
+        dispatcher.stop()
+        loop.join()
+        dispatcher.close()  # drops every client connection
+    
+    dispatcher, loop = serve(0)
+    port = dispatcher.listener.getsockname()[1]
+    patterns = ['c?t', 'b??k', '3422', '??'] * 10
+    expected = [testServer.findQuery(pattern) for pattern in patterns]
+    try:
+        with WordClient('localhost', port, pool_size=2, in_flight=4, timeout=10) as client:
+            assert client.opened == len(client.idle) == 1     # one connection up front, more as calls need them
+            assert client.query('cat') == (['cat'], 1)
+            assert client.query_many(patterns) == expected
+            assert client.count('?????') == testServer.countQuery('?????')
+            for pattern in ['COUNT cat', 'STATS', 'c?t limit=2', 'PROFILE stop']:  # never read as a command or options
+                with pytest.raises(QueryError):
+                    client.query(pattern)
+            
+            shutdown(dispatcher, loop)  # server restart, the pooled connections are dead
+            dispatcher, loop = serve(port)
+            assert client.query_many(patterns) == expected
+            assert client.opened <= 2      # failed connections were dropped, not added to
+        
+        async def scenario():
+            async with AsyncWordClient('localhost', port, pool_size=3, in_flight=4, timeout=10) as client:
+                assert await client.query_many(patterns) == expected
+                assert await client.count('c?t') == 6
+                for connection in client.connections:
+                    connection.writer.transport.abort()     # connections lost under the client
+                return await client.query('cat')
+        
+        assert asyncio.run(scenario()) == (['cat'], 1)
+    finally:
+        shutdown(dispatcher, loop)
+
+def test_word_client_served_by_default_dispatcher():
+    probe = socket(AF_INET, SOCK_STREAM)    # a free port for the dispatcher, which does not report its own
+    probe.bind(('localhost', 0))
+    port = probe.getsockname()[1]
+    probe.close()
+    testServer = ThreadServer(host='localhost', port=port, cache=None)   # a single client thread
+    threading.Thread(target=testServer.dispatcher, daemon=True).start()
+    
+    deadline = time.monotonic() + 10
+    while True:     # wait for the dispatcher to listen
+        with socket(AF_INET, SOCK_STREAM) as sock:
+            try:
+                sock.connect(('localhost', port))
+                break
+            except ConnectionRefusedError:
+                assert time.monotonic() < deadline
+                time.sleep(0.05)
+    
+    for _ in range(2):  # the second client gets the thread once the first one closed its connection
+        with WordClient('localhost', port, timeout=10) as client:
+            assert client.query('cat') == (['cat'], 1)
+            assert client.query_many(['c?t', 'b??k']) == [testServer.findQuery('c?t'), testServer.findQuery('b??k')]
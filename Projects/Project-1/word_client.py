@@ -0,0 +1,307 @@
+'''Client library of the word servers, for programs rather than people at a prompt
+
+Both clients keep a pool of persistent connections that are past the "200 OK" handshake and upgraded
+to the framed protocol, pipeline requests on them, and reconnect when the server drops a connection.
+Connections are opened as concurrent calls need them. A pooled connection holds one of the server's
+client threads for as long as it is open, and the thread dispatchers run a single one unless they have
+worker processes, so the pool holds one connection by default:
+
+    with WordClient('localhost', 50007) as client:
+        words, matches = client.query('c?t')
+        results = client.query_many(['c?t', 'b??k'])
+        matches = client.count('?????')
+
+    async with AsyncWordClient('localhost', 50007) as client:
+        words, matches = await client.query('c?t')
+
+Queries only read the word list, so a request whose connection failed is simply sent again on a new
+connection. A "400" reply raises QueryError, a server that sheds the connection with "503 BUSY" is
+retried after the delay it asks for as long as the timeout allows.
+'''
+import asyncio
+import itertools
+import threading
+import time
+from framing import PROTO_PREFIX, VERSION, HEADER, QUERY, COUNT_QUERY, ERROR, RESPONSE
+from framing import FramedClient, FramingError, ServerBusy, encode_frame, decode_header
+from protocol import decode_reply, decode_count, parse_busy
+
+class WordClient():
+    '''Blocking client, safe to share between threads.
+
+    Each call borrows one of at most pool_size connections, opened when no idle one is left, and
+    pipelines its requests on it, with up
+    to in_flight requests sent ahead of their replies. timeout bounds connecting, every read and the
+    wait for a free connection. A call whose connection is closed or reset by the server is retried
+    up to retries times on a new connection; a timeout is not retried, the connection is dropped since
+    its replies may still arrive.
+    '''
+    def __init__(self, host: str='localhost', port: int=50007, pool_size: int=1, in_flight: int=32, timeout: float=10.0, retries: int=2):
+        self.host = host
+        self.port = port
+        self.pool_size = pool_size
+        self.in_flight = in_flight
+        self.timeout = timeout
+        self.retries = retries
+        self.idle: list[FramedClient] = []  # open connections no call is using
+        self.opened = 0     # connections open or being opened, idle or not
+        self.available = threading.Condition()
+
+    def __enter__(self) -> 'WordClient':
+        return self.connect()
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+    def connect(self) -> 'WordClient':
+        '''Opens one connection now instead of on first use, so an unreachable server fails here'''
+        self.release(self.acquire())
+        return self
+
+    def close(self):
+        '''Closes the idle connections, connections in use are closed when their call returns'''
+        with self.available:
+            for connection in self.idle:
+                connection.close()
+            self.opened -= len(self.idle)
+            self.idle.clear()
+
+    def open(self, deadline: float) -> FramedClient:
+        '''Opens one connection, waiting out "503 BUSY" answers until the deadline'''
+        while True:
+            connection = FramedClient(self.host, self.port, self.timeout)
+            try:
+                connection.connect()
+                return connection
+            except ServerBusy as e:
+                if time.monotonic() + e.retry_after > deadline:
+                    raise
+                time.sleep(e.retry_after)
+
+    def acquire(self) -> FramedClient:
+        '''Returns an idle connection, or a new one while the pool is not full'''
+        deadline = time.monotonic() + self.timeout
+        with self.available:
+            while not self.idle and self.opened >= self.pool_size:
+                remaining = deadline - time.monotonic()
+                if remaining <= 0 or not self.available.wait(remaining):
+                    raise TimeoutError(f'No free connection to {self.host}:{self.port} within {self.timeout:g} seconds')
+            if self.idle:
+                return self.idle.pop()
+            self.opened += 1
+
+        try:
+            return self.open(deadline)
+        except BaseException:
+            with self.available:
+                self.opened -= 1
+                self.available.notify()
+            raise
+
+    def release(self, connection: FramedClient, broken: bool=False):
+        '''Returns a connection to the pool, or closes it when it can not be used anymore'''
+        with self.available:
+            if broken:
+                connection.close()
+                self.opened -= 1
+            else:
+                self.idle.append(connection)
+            self.available.notify()
+
+    def request(self, patterns: list[str], opcode: int=QUERY) -> list[bytes]:
+        '''Sends the patterns as requests of one kind on one connection, returns the replies in order'''
+        for attempt in range(self.retries + 1):
+            connection = self.acquire()
+            try:
+                replies = connection.pipeline(patterns, opcode, self.in_flight)
+            except OSError as e:
+                self.release(connection, broken=True)
+                if isinstance(e, TimeoutError) or attempt == self.retries:
+                    raise
+                continue    # the server closed or reset the connection, try again on a new one
+            except BaseException:
+                self.release(connection, broken=True)   # replies of the pipeline may be left unread
+                raise
+            self.release(connection)
+            return replies
+
+    def query(self, pattern: str) -> tuple[list[str], int]:
+        '''Returns the words matching the pattern and the number of matches'''
+        return decode_reply(self.request([pattern])[0])
+
+    def query_many(self, patterns: list[str]) -> list[tuple[list[str], int]]:
+        '''Returns the words and number of matches of every pattern, in order, pipelined on one connection'''
+        return [decode_reply(reply) for reply in self.request(list(patterns))]
+
+    def count(self, pattern: str) -> int:
+        '''Returns the number of words matching the pattern, without transferring them'''
+        return decode_count(self.request([pattern], COUNT_QUERY)[0])
+
+class AsyncConnection():
+    '''One framed connection of an AsyncWordClient, handing each reply to the request waiting for its ID'''
+    def __init__(self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter, in_flight: int):
+        self.reader = reader
+        self.writer = writer
+        self.ids = itertools.count(1)
+        self.waiting: dict[int, asyncio.Future] = {}    # request ID to the future of its reply
+        self.slots = asyncio.Semaphore(in_flight)   # requests sent and not answered yet
+        self.closed = False
+        self.receiver = asyncio.create_task(self.receive())
+
+    @classmethod
+    async def open(cls, host: str, port: int, in_flight: int) -> 'AsyncConnection':
+        '''Connects, waits for the "200 OK" handshake and upgrades the connection to framing'''
+        reader, writer = await asyncio.open_connection(host, port)
+        try:
+            handshake = await reader.readexactly(6)
+            if handshake != b'200 OK':
+                retry_after = parse_busy(handshake + await reader.read(1024))
+                if retry_after is not None:
+                    raise ServerBusy(retry_after)
+                raise FramingError('Server did not complete the handshake')
+            writer.write(PROTO_PREFIX + f'{VERSION}\n'.encode())
+            line = await reader.readline()
+            if line != f'200 PROTO {VERSION}\n'.encode():
+                raise FramingError(f'Server refused framing: {line!r}')
+        except asyncio.IncompleteReadError:
+            writer.close()
+            raise ConnectionError('Server closed the connection during the handshake')
+        except BaseException:
+            writer.close()
+            raise
+        return cls(reader, writer, in_flight)
+
+    async def request(self, opcode: int, payload: bytes) -> bytes:
+        '''Sends one request and returns the payload of its reply'''
+        async with self.slots:
+            if self.closed:
+                raise ConnectionError('Connection closed')
+            request_id = next(self.ids) & 0xFFFFFFFF
+            future = asyncio.get_running_loop().create_future()
+            self.waiting[request_id] = future
+            try:
+                self.writer.write(encode_frame(opcode, request_id, payload))
+                await self.writer.drain()
+                return await future
+            finally:
+                del self.waiting[request_id]
+                if future.done() and not future.cancelled():
+                    future.exception()  # marks it retrieved when sending failed before the reply was awaited
+
+    async def receive(self):
+        '''Reads replies until the connection closes, then fails every request still waiting'''
+        error: Exception = ConnectionError('Server closed the connection')
+        try:
+            while True:
+                opcode, _, request_id, length = decode_header(await self.reader.readexactly(HEADER.size))
+                payload = await self.reader.readexactly(length)
+                future = self.waiting.get(request_id)
+                if future is None or future.done():     # its request timed out or was cancelled
+                    continue
+                if opcode == ERROR | RESPONSE:
+                    future.set_exception(FramingError(payload.decode(errors='replace')))
+                else:
+                    future.set_result(payload)
+        except asyncio.IncompleteReadError:
+            pass
+        except asyncio.CancelledError:
+            error = ConnectionError('Connection closed')
+        except (OSError, FramingError) as e:
+            error = e if isinstance(e, OSError) else ConnectionError(str(e))
+        finally:
+            self.closed = True
+            for future in self.waiting.values():
+                if not future.done():
+                    future.set_exception(error)
+            self.writer.close()
+
+    def close(self):
+        '''Closes the connection, failing the requests still waiting'''
+        self.closed = True
+        self.receiver.cancel()
+
+class AsyncWordClient():
+    '''asyncio client with the same calls as WordClient, as coroutines.
+
+    Requests are spread over the pool_size connections in turn, each opened the first time its turn
+    comes, and any number of them may be awaited at once; each connection has at most in_flight of them sent ahead of their replies. A request
+    that times out leaves its connection usable, its late reply is dropped when it arrives.
+    '''
+    def __init__(self, host: str='localhost', port: int=50007, pool_size: int=1, in_flight: int=32, timeout: float=10.0, retries: int=2):
+        self.host = host
+        self.port = port
+        self.pool_size = pool_size
+        self.in_flight = in_flight
+        self.timeout = timeout
+        self.retries = retries
+        self.connections: list[AsyncConnection | None] = [None] * pool_size
+        self.locks = [asyncio.Lock() for _ in range(pool_size)]    # one connection opened per slot at a time
+        self.turns = itertools.count()
+
+    async def __aenter__(self) -> 'AsyncWordClient':
+        return await self.connect()
+
+    async def __aexit__(self, *exc_info):
+        await self.close()
+
+    async def connect(self) -> 'AsyncWordClient':
+        '''Opens one connection now instead of on first use, so an unreachable server fails here'''
+        await self.connection(0)
+        return self
+
+    async def close(self):
+        '''Closes every connection'''
+        receivers = []
+        for slot, connection in enumerate(self.connections):
+            if connection is not None:
+                connection.close()
+                receivers.append(connection.receiver)
+            self.connections[slot] = None
+        await asyncio.gather(*receivers, return_exceptions=True)
+
+    async def open(self) -> AsyncConnection:
+        '''Opens one connection, waiting out "503 BUSY" answers within the timeout'''
+        loop = asyncio.get_running_loop()
+        deadline = loop.time() + self.timeout
+        while True:
+            try:
+                return await asyncio.wait_for(AsyncConnection.open(self.host, self.port, self.in_flight), self.timeout)
+            except ServerBusy as e:
+                if loop.time() + e.retry_after > deadline:
+                    raise
+                await asyncio.sleep(e.retry_after)
+
+    async def connection(self, slot: int | None=None) -> AsyncConnection:
+        '''Returns the connection of a slot, the next one in turn by default, opening it if needed'''
+        if slot is None:
+            slot = next(self.turns) % self.pool_size
+        async with self.locks[slot]:
+            connection = self.connections[slot]
+            if connection is None or connection.closed:
+                connection = self.connections[slot] = await self.open()
+            return connection
+
+    async def request(self, pattern: str, opcode: int=QUERY) -> bytes:
+        '''Sends one request and returns its reply, on a new connection if its connection fails'''
+        for attempt in range(self.retries + 1):
+            connection = await self.connection()
+            try:
+                return await asyncio.wait_for(connection.request(opcode, pattern.encode()), self.timeout)
+            except TimeoutError:
+                raise
+            except OSError:
+                connection.close()
+                if attempt == self.retries:
+                    raise
+
+    async def query(self, pattern: str) -> tuple[list[str], int]:
+        '''Returns the words matching the pattern and the number of matches'''
+        return decode_reply(await self.request(pattern))
+
+    async def query_many(self, patterns: list[str]) -> list[tuple[list[str], int]]:
+        '''Returns the words and number of matches of every pattern, in order, with all of them in flight at once'''
+        return list(await asyncio.gather(*(self.query(pattern) for pattern in patterns)))
+
+    async def count(self, pattern: str) -> int:
+        '''Returns the number of words matching the pattern, without transferring them'''
+        return decode_count(await self.request(pattern, COUNT_QUERY))
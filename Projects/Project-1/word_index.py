@@ -0,0 +1,152 @@
+'''Persisted, memory-mapped index of the word list, saving the bitsets of the "index" engine
+
+The index file holds the newline-joined words, a fingerprint of the word list they came from and
+(optionally) the positional bitsets of the "index" engine, over the word list and, for the length
+buckets holding duplicates, over their distinct words as BasicServer matches them. Decoding the words costs about as much as
+reading wordlist.txt; what the file saves is building the bitsets, loaded from it about seven times
+faster than they are computed. It is mapped read-only, so every server process shares the same pages
+of the OS page cache. Running this module rebuilds the index offline.
+'''
+import hashlib
+import mmap
+import os
+import struct
+from positional_index import to_bitset
+
+ROOT = os.path.dirname(os.path.abspath(__file__))
+WORDLIST_PATH = os.path.join(ROOT, 'wordlist.txt')
+INDEX_PATH = os.path.join(ROOT, 'wordlist.idx')
+
+MAGIC = b'WQIX3\n'
+HEADER = struct.Struct('<6s2xqq20sIIII')   # magic, source mtime_ns, source size, source sha1, words, blob bytes, postings, distinct postings
+POSTING = struct.Struct('<HHIII')           # word length, position, character, bitset offset, bitset bytes
+
+def source_stamp(wordlist_path: str) -> tuple[int, int]:
+    '''Returns the (mtime_ns, size) a saved index records for the word list it was built from'''
+    stat = os.stat(wordlist_path)
+    return stat.st_mtime_ns, stat.st_size
+
+def align(n: int) -> int:
+    '''Rounds a section size up to a multiple of 4 so the next u32 section is aligned'''
+    return (n + 3) & ~3
+
+def pack_postings(buckets: dict[int, list[str]], table: list[bytes], bits: bytearray):
+    '''Appends the positional bitsets of every length bucket to the postings table and bits'''
+    for length, bucket in sorted(buckets.items()):
+        ids: dict[tuple[int, str], list[int]] = {}
+        for word_id, word in enumerate(bucket):
+            for position, char in enumerate(word):
+                ids.setdefault((position, char), []).append(word_id)
+        for (position, char), key_ids in ids.items():
+            bitset = to_bitset(key_ids, len(bucket)).to_bytes((len(bucket) + 7) // 8, 'little')
+            table.append(POSTING.pack(length, position, ord(char), len(bits), len(bitset)))
+            bits += bitset
+
+def build_index(wordlist_path: str=WORDLIST_PATH, index_path: str=INDEX_PATH, postings: bool=True):
+    '''Builds the binary index of the word list and atomically replaces the index file with it'''
+    with open(wordlist_path, 'rb') as f:
+        source = f.read()
+    mtime_ns, size = source_stamp(wordlist_path)
+    words = source.decode().splitlines()
+
+    blob = ('\n'.join(words) + '\n').encode() if words else b''
+
+    table, bits = [], bytearray()
+    distinct_count = 0
+    if postings:
+        buckets: dict[int, list[str]] = {}     # word IDs are local to a length, in file order like PositionalIndex
+        for word in words:
+            buckets.setdefault(len(word), []).append(word)
+        pack_postings(buckets, table, bits)
+        word_count = len(table)
+        distinct = {length: list(dict.fromkeys(bucket)) for length, bucket in buckets.items() if len(set(bucket)) < len(bucket)}
+        pack_postings(distinct, table, bits)    # only the buckets whose IDs shift once duplicates are dropped
+        distinct_count = len(table) - word_count
+
+    header = HEADER.pack(MAGIC, mtime_ns, size, hashlib.sha1(source).digest(), len(words), len(blob), len(table) - distinct_count, distinct_count)
+    sections = [
+        blob.ljust(align(len(blob)), b'\0'),
+        b''.join(table),
+        bytes(bits),
+    ]
+
+    temp_path = f'{index_path}.{os.getpid()}.tmp'
+    with open(temp_path, 'wb') as f:
+        f.write(header)
+        for section in sections:
+            f.write(section)
+    os.replace(temp_path, index_path)   # readers never see a half-written index
+
+class WordIndex():
+    '''Read-only view of an index file, mapped into memory'''
+    def __init__(self, index_path: str=INDEX_PATH):
+        with open(index_path, 'rb') as f:
+            self.mm = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+
+        magic, self.mtime_ns, self.size, self.sha1, self.count, self.blob_len, self.posting_count, self.distinct_count = HEADER.unpack_from(self.mm)
+        if magic != MAGIC:
+            raise ValueError(f'{index_path} is not a word index')
+
+        view = memoryview(self.mm)
+        start = HEADER.size
+        self.blob = view[start:start + self.blob_len]
+        start += align(self.blob_len)
+        table_len = POSTING.size * (self.posting_count + self.distinct_count)
+        self.table = view[start:start + table_len]
+        self.bits = view[start + table_len:]
+
+    def is_fresh(self, wordlist_path: str=WORDLIST_PATH) -> bool:
+        '''Checks the index was built from the current word list, by its mtime and size or else by its hash'''
+        if source_stamp(wordlist_path) == (self.mtime_ns, self.size):
+            return True
+        with open(wordlist_path, 'rb') as f:    # touched or copied but maybe unchanged
+            return hashlib.sha1(f.read()).digest() == self.sha1
+
+    def words(self) -> list[str]:
+        '''Returns every word in word list order'''
+        if not self.count:
+            return []
+        return str(self.blob, 'utf-8').split('\n')[:self.count]
+
+    def postings(self, unique: bool=False) -> dict[int, dict[tuple[int, str], int]] | None:
+        '''Returns the positional bitsets of every length bucket, or None when the index was built without them.
+
+        unique returns them over the distinct words instead of the word list, as BasicServer matches.
+        '''
+        if not self.posting_count:
+            return None
+
+        postings: dict[int, dict[tuple[int, str], int]] = {}
+        table = POSTING.size * self.posting_count
+        for length, position, char, offset, nbytes in POSTING.iter_unpack(self.table[:table]):
+            postings.setdefault(length, {})[(position, chr(char))] = int.from_bytes(self.bits[offset:offset + nbytes], 'little')
+        if unique:  # replace the buckets holding duplicates
+            distinct: dict[int, dict[tuple[int, str], int]] = {}
+            for length, position, char, offset, nbytes in POSTING.iter_unpack(self.table[table:]):
+                distinct.setdefault(length, {})[(position, chr(char))] = int.from_bytes(self.bits[offset:offset + nbytes], 'little')
+            postings.update(distinct)
+        return postings
+
+    def close(self):
+        '''Releases the memory map, after which the views of this index can not be used'''
+        for view in (self.blob, self.table, self.bits):
+            view.release()
+        self.mm.close()
+
+def open_index(wordlist_path: str=WORDLIST_PATH, index_path: str=INDEX_PATH, postings: bool=True) -> WordIndex:
+    '''Maps the index of the word list, (re)building it first when it is missing or stale'''
+    try:
+        index = WordIndex(index_path)
+        if index.is_fresh(wordlist_path) and (index.posting_count or not postings):
+            return index
+        index.close()
+    except (OSError, ValueError, struct.error):
+        pass
+
+    build_index(wordlist_path, index_path, postings)
+    return WordIndex(index_path)
+
+if __name__ == '__main__':  # build the index offline so the first server does not pay for it
+    build_index()
+    index = WordIndex()
+    print(f'Saved {index.count} words and {index.posting_count} posting lists to {INDEX_PATH}')
@@ -0,0 +1,113 @@
+'''The dictionary, loaded lazily exactly once per process and shared by every server and test'''
+import signal
+import threading
+from functools import cached_property
+from types import MappingProxyType
+from engines import make_engine
+from word_index import WordIndex, WORDLIST_PATH, INDEX_PATH, open_index
+
+def group_by_length(words: tuple[str, ...]) -> MappingProxyType:
+    '''Returns a read-only mapping of each word length to the words of that length, in order'''
+    buckets: dict[int, list[str]] = {}
+    for word in words:
+        buckets.setdefault(len(word), []).append(word)
+    return MappingProxyType({length: tuple(bucket) for length, bucket in buckets.items()})
+
+class WordStore():
+    '''Immutable views of one loaded word list, built on first use.
+
+    Servers only read from the store, so one instance (and every engine built over it) is safely
+    shared by all of them instead of each server holding its own copy of the dictionary.
+    '''
+    def __init__(self, word_index: WordIndex):
+        self.word_index = word_index
+        self.words: tuple[str, ...] = tuple(word_index.words())    # word list order, duplicates kept
+        self.engines = {}
+        self.lock = threading.Lock()
+
+    @property
+    def version(self) -> bytes:
+        '''Fingerprint of the loaded word list, changes whenever its contents change'''
+        return self.word_index.sha1
+
+    @cached_property
+    def word_set(self) -> frozenset[str]:
+        '''Distinct words'''
+        return frozenset(self.words)
+
+    @cached_property
+    def unique_words(self) -> tuple[str, ...]:
+        '''Distinct words in word list order'''
+        return tuple(dict.fromkeys(self.words))
+
+    @cached_property
+    def buckets(self) -> MappingProxyType:
+        '''Words of each length in word list order, duplicates kept'''
+        return group_by_length(self.words)
+
+    @cached_property
+    def unique_buckets(self) -> MappingProxyType:
+        '''Distinct words of each length in word list order'''
+        return group_by_length(self.unique_words)
+
+    @cached_property
+    def sorted_words(self) -> tuple[str, ...]:
+        '''Distinct words in sorted order, for binary searches'''
+        return tuple(sorted(self.word_set))
+
+    def engine(self, name: str, substring: bool=False, unique: bool=False):
+        '''Returns the named engine over the words, built once and then shared.
+
+        unique builds it over the distinct words, like BasicServer's set, instead of the word list.
+        '''
+        key = (name, substring, unique)
+        with self.lock:     # two servers starting together must not build the same engine twice
+            if key not in self.engines:
+                words = self.unique_words if unique else self.words
+                self.engines[key] = make_engine(name, list(words), substring, word_index=self.word_index, unique=unique)
+            return self.engines[key]
+
+store: WordStore | None = None
+store_lock = threading.Lock()
+reload_lock = threading.Lock()  # one reload at a time
+
+def get_store() -> WordStore:
+    '''Returns the process-wide word store, mapping the word index on the first call'''
+    global store
+    if store is None:
+        with store_lock:
+            if store is None:   # another thread may have loaded it while we waited
+                store = WordStore(open_index())
+    return store
+
+def load_store(wordlist_path: str=WORDLIST_PATH, index_path: str=INDEX_PATH, engines=()) -> WordStore:
+    '''Returns a new store of the word list, rebuilding its index first if the file changed.
+
+    engines lists the (name, substring, unique) engines to build right away, so the queries that
+    first use the store do not pay for them.
+    '''
+    new = WordStore(open_index(wordlist_path, index_path))
+    for name, substring, unique in engines:
+        new.engine(name, substring, unique)
+    return new
+
+def reload_store(wordlist_path: str=WORDLIST_PATH, index_path: str=INDEX_PATH) -> WordStore:
+    '''Loads the word list again and makes it the process-wide store, returning it.
+
+    The engines of the current store are built for the new one before the swap. The current store is
+    left untouched, so queries still holding it finish against the old word list.
+    '''
+    global store
+    with reload_lock:
+        new = load_store(wordlist_path, index_path, engines=list(get_store().engines))
+        with store_lock:
+            store = new
+    return new
+
+def reload_on_signal(reload, signum: int | None=getattr(signal, 'SIGHUP', None)):
+    '''Runs reload() in a background thread whenever the process receives signum, SIGHUP by default.
+
+    Does nothing on platforms without the signal. Must be called from the main thread.
+    '''
+    if signum is not None:
+        signal.signal(signum, lambda *_: threading.Thread(target=reload, daemon=True).start())